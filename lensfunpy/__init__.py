@@ -4,7 +4,7 @@ from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from lensfunpy._lensfun import (
-        Database, Camera, Mount, Lens, Modifier,
+        Database, DatabaseWatcher, Camera, Mount, Lens, Modifier,
         ModifyFlags, LensType, DistortionModel, TCAModel, VignettingModel,
         LensCalibDistortion, LensCalibTCA, LensCalibVignetting,
         LensfunError, XMLFormatError
@@ -0,0 +1,108 @@
+"""
+Index of the camera makers, lens makers and mounts contained in each bundled
+database file, used by ``Database(lazy=True)`` to parse only the files a query needs.
+
+This module is pure Python so that setup.py can write the index when bundling
+the database files, without importing the compiled extension.
+"""
+from __future__ import annotations
+
+import os
+import re
+import json
+from typing import Any, Dict, Iterable, List, Set
+
+INDEX_NAME = 'index.json'
+INDEX_VERSION = 1
+
+KEYS = ('camera_makers', 'lens_makers', 'lens_mounts', 'mounts')
+
+_COMMENT = re.compile(r'<!--.*?-->', re.S)
+_ENTRY = re.compile(r'<(camera|lens|mount)>(.*?)</\1>', re.S)
+_MAKER = re.compile(r'<maker\b[^>]*>([^<]*)</maker>')
+_MOUNT = re.compile(r'<mount>([^<]*)</mount>')
+_NAME = re.compile(r'<name\b[^>]*>([^<]*)</name>')
+
+# per-process memo of loaded indices, keyed by directory and file sizes
+_memo: Dict[tuple, Dict[str, Dict[str, Set[str]]]] = {}
+
+def normalize(name: str) -> str:
+    """
+    Normalize a maker or mount name for index lookups.
+    lensfun compares names ignoring case and spaces, this may only match more, never less.
+    """
+    return ''.join(name.split()).lower()
+
+def scan_file(path: str) -> Dict[str, Any]:
+    """
+    Collect the normalized camera makers, lens makers, lens mounts and mount names
+    of a database file. All language variants of maker names are included.
+    """
+    with open(path, encoding='utf-8') as f:
+        xml = _COMMENT.sub('', f.read())
+    entry: Dict[str, Set[str]] = {key: set() for key in KEYS}
+    for match in _ENTRY.finditer(xml):
+        kind, body = match.groups()
+        if kind == 'camera':
+            entry['camera_makers'].update(map(normalize, _MAKER.findall(body)))
+        elif kind == 'lens':
+            entry['lens_makers'].update(map(normalize, _MAKER.findall(body)))
+            entry['lens_mounts'].update(map(normalize, _MOUNT.findall(body)))
+        else:
+            entry['mounts'].update(map(normalize, _NAME.findall(body)))
+    result: Dict[str, Any] = {key: sorted(values) for key, values in entry.items()}
+    result['size'] = os.path.getsize(path)
+    return result
+
+def write_index(directory: str) -> str:
+    """
+    Scan all database files in `directory` and write the index next to them.
+
+    :return: path of the written index
+    """
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.xml'):
+            files[name] = scan_file(os.path.join(directory, name))
+    path = os.path.join(directory, INDEX_NAME)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'version': INDEX_VERSION, 'files': files}, f, indent=0, sort_keys=True)
+    return path
+
+def load_index(paths: List[str]) -> Dict[str, Dict[str, Set[str]]]:
+    """
+    Return the index entries of the given database files, keyed by path.
+
+    Entries are taken from the index file in the files' directory where its
+    recorded size matches, all other files are scanned.
+    """
+    sizes = tuple((path, os.path.getsize(path)) for path in paths)
+    try:
+        return _memo[sizes]
+    except KeyError:
+        pass
+    stored = {}
+    for directory in set(os.path.dirname(path) for path in paths):
+        try:
+            with open(os.path.join(directory, INDEX_NAME), encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if index.get('version') == INDEX_VERSION:
+            for name, entry in index['files'].items():
+                stored[os.path.join(directory, name)] = entry
+    result = {}
+    for path, size in sizes:
+        entry = stored.get(path)
+        if entry is None or entry['size'] != size:
+            entry = scan_file(path)
+        result[path] = {key: set(entry[key]) for key in KEYS}
+    _memo[sizes] = result
+    return result
+
+def files_with(index: Dict[str, Dict[str, Set[str]]], key: str, names: Iterable[str]) -> List[str]:
+    """
+    Return the files whose entry for `key` contains any of the given names.
+    """
+    names = set(map(normalize, names))
+    return [path for path, entry in index.items() if entry[key] & names]
@@ -2,14 +2,16 @@
 from __future__ import annotations
 
 from enum import Enum, IntEnum
-from typing import Optional, List, Tuple, NamedTuple, Any
+from typing import Optional, List, Tuple, NamedTuple, Any, Iterable
 import numpy as np
-from numpy.typing import NDArray
+from numpy.typing import ArrayLike, NDArray
 
 # Module-level version and constants
 lensfun_version: Tuple[int, int, int, int]
 LF_NO_DATABASE: int
 
+def _newFileMode() -> int: ...
+
 # Named tuples for calibration data
 class LensCalibDistortion(NamedTuple):
     model: DistortionModel
@@ -28,6 +30,17 @@ class LensCalibVignetting(NamedTuple):
     distance: float
     terms: List[float]
 
+# Structured array dtypes returned by Lens.interpolate_*_array
+calib_distortion_dtype: np.dtype[np.void]
+calib_tca_dtype: np.dtype[np.void]
+calib_vignetting_dtype: np.dtype[np.void]
+
+class DatabaseArrays(NamedTuple):
+    lenses: NDArray[np.void]
+    distortion: NDArray[np.void]
+    tca: NDArray[np.void]
+    vignetting: NDArray[np.void]
+
 # Enums
 class ModifyFlags(IntEnum):
     """
@@ -94,6 +107,10 @@ class Database:
     
     Database instances load lens correction data from XML files and provide
     search functionality for cameras, lenses, and mounts.
+    
+    A database may be shared by threads. Lookups run concurrently and release the GIL
+    while lensfun searches, they only wait while lensfun adds entries in place.
+    Searches which score matches, find_lenses and loose find_cameras, run one at a time.
     """
     
     def __init__(
@@ -101,7 +118,9 @@ class Database:
         paths: Optional[List[str]] = None,
         xml: Optional[str] = None,
         load_common: bool = True,
-        load_bundled: bool = True
+        load_bundled: bool = True,
+        lazy: bool = False,
+        lookup_cache_size: int = 1024
     ) -> None:
         """
         Initialize a lensfun database.
@@ -110,6 +129,111 @@ class Database:
         :param xml: load data from XML string
         :param load_common: whether to load the system/user database files
         :param load_bundled: whether to load the bundled database files
+        :param lazy: whether to load each bundled database file only once a query may need it,
+                     based on an index of the makers and mounts in each file.
+                     Entries of the other sources keep overriding bundled ones.
+        :param lookup_cache_size: maximum number of find_cameras and find_lenses results
+                                  to memoize, 0 to disable
+        """
+        ...
+    
+    @classmethod
+    def from_snapshot(
+        cls,
+        path: str,
+        paths: Optional[List[str]] = None,
+        load_common: bool = True,
+        load_bundled: bool = True
+    ) -> Database:
+        """
+        Load the database from a snapshot file written by save_snapshot.
+        
+        If the snapshot is missing, was made from other sources, or a source file
+        was modified since, the database is loaded from the sources and a new
+        snapshot of the full database is written to `path`.
+        Changes to the system/user database files are not detected.
+        
+        :param path: snapshot file
+        :param paths: XML files the snapshot is made from
+        :param load_common: whether the snapshot includes the system/user database files
+        :param load_bundled: whether the snapshot includes the bundled database files
+        :return: the loaded database
+        """
+        ...
+    
+    @property
+    def fingerprint(self) -> str:
+        """
+        A hash of the lensfun version and the sources the database was loaded from,
+        including the modification times and sizes of the files.
+        
+        Pickled databases, cameras, lenses and modifiers refer to their database by
+        the fingerprint and the arguments it was created with, never by its XML data.
+        A database with XML data given as string must be created in the unpickling
+        process first, e.g. in the initializer of a process pool.
+        """
+        ...
+    
+    def load_file(self, path: str) -> None:
+        """
+        Load an XML file into the database, e.g. a new calibration.
+        
+        Entries of the file override matching entries already loaded. Other entries are
+        added in place, and existing Camera, Lens and Mount instances stay valid.
+        A file with matching entries is loaded into a new database together with all
+        other sources instead, see reload.
+        Loading a file again after it was modified adds its new entries in place as well,
+        as long as its other entries are unchanged.
+        
+        :param path: XML file
+        """
+        ...
+    
+    def load_xml(self, xml: str) -> None:
+        """
+        Load data from an XML string into the database, see load_file.
+        
+        :param xml: XML data
+        """
+        ...
+    
+    def reload(self) -> None:
+        """
+        Load the database again from all its sources and swap the new database in.
+        Lookups continue on the current database meanwhile.
+        Files which no longer exist are dropped from the sources.
+        """
+        ...
+    
+    def watch(self, directories: Iterable[str], interval: float = 2.0) -> DatabaseWatcher:
+        """
+        Keep the database up to date with the XML files in some directories,
+        checked periodically in a background thread.
+        
+        New and modified files are loaded with load_file, so only changes other than
+        new entries load a new database. Deleted files are dropped with reload.
+        
+        :param directories: directories to watch, other than the system/user database directories
+        :param interval: seconds between checks
+        :return: the watcher, stop it with DatabaseWatcher.stop
+        """
+        ...
+    
+    def save_snapshot(
+        self,
+        path: str,
+        cameras: Optional[List[Camera]] = None,
+        lenses: Optional[List[Lens]] = None
+    ) -> None:
+        """
+        Save the database, or only some cameras and lenses, as a single snapshot file.
+        
+        A snapshot restricted to the cameras and lenses actually used loads in a few
+        milliseconds, a full snapshot about as fast as the original XML files.
+        
+        :param path: snapshot file, replaced atomically
+        :param cameras: cameras to include, all if both cameras and lenses are None
+        :param lenses: lenses to include, all if both cameras and lenses are None
         """
         ...
     
@@ -182,6 +306,76 @@ class Database:
         :return: list of matching Lens instances
         """
         ...
+    
+    def find_lenses_batch(
+        self,
+        queries: Iterable[Tuple[Camera, Optional[str], Optional[str]]],
+        loose_search: bool = False
+    ) -> List[List[Lens]]:
+        """
+        Find the lenses for many (camera, maker, lens) queries at once,
+        e.g. the EXIF data of a batch of images. Repeated queries are only resolved once.
+        
+        :param queries: (camera, maker, lens) tuples as for find_lenses
+        :param loose_search: whether to use fuzzy matching
+        :return: list of matching Lens instances for each query
+        """
+        ...
+    
+    def to_arrays(self) -> DatabaseArrays:
+        """
+        Export all lenses and their calibration data as structured arrays, in one pass.
+        
+        The `lenses` array has the fields maker, model, type (LensType value),
+        min_focal, max_focal, min_aperture, max_aperture (NaN if unknown) and crop_factor,
+        in the order of the lenses property.
+        The `distortion`, `tca` and `vignetting` arrays hold one row per calibration entry,
+        with the field lens indexing the `lenses` array followed by the fields of
+        calib_distortion_dtype, calib_tca_dtype or calib_vignetting_dtype.
+        
+        :return: the lenses and calibration arrays
+        """
+        ...
+    
+    def clear_lookup_cache(self) -> None:
+        """
+        Forget all memoized find_cameras and find_lenses results.
+        """
+        ...
+
+class DatabaseWatcher:
+    """
+    Applies changes of the XML files in some directories to a database, see Database.watch.
+    """
+    
+    db: Database
+    directories: List[str]
+    interval: float
+    
+    def __init__(self, db: Database, directories: Iterable[str], interval: float = 2.0) -> None: ...
+    
+    def check(self) -> bool:
+        """
+        Apply the changes since the last check.
+        
+        :return: whether the database changed
+        """
+        ...
+    
+    def start(self) -> None:
+        """
+        Check periodically in a daemon thread until stop is called.
+        """
+        ...
+    
+    def stop(self) -> None:
+        """
+        Stop checking, waiting for a running check to finish.
+        """
+        ...
+    
+    def __enter__(self) -> DatabaseWatcher: ...
+    def __exit__(self, *exc: Any) -> None: ...
 
 class Camera:
     """
@@ -231,6 +425,7 @@ class Camera:
         ...
     
     def __eq__(self, other: object) -> bool: ...
+    def __hash__(self) -> int: ...
     def __repr__(self) -> str: ...
 
 class Mount:
@@ -255,6 +450,7 @@ class Mount:
         ...
     
     def __eq__(self, other: object) -> bool: ...
+    def __hash__(self) -> int: ...
     def __repr__(self) -> str: ...
 
 class Lens:
@@ -401,7 +597,45 @@ class Lens:
         """
         ...
     
+    def interpolate_distortion_array(self, focal: ArrayLike) -> NDArray[np.void]:
+        """
+        Interpolate distortion calibration for an array of focal lengths in one call.
+        
+        :param focal: focal lengths in mm
+        :return: structured array of the same shape with :data:`calib_distortion_dtype`,
+                 entries without calibration data have model DistortionModel.NONE
+        """
+        ...
+    
+    def interpolate_tca_array(self, focal: ArrayLike) -> NDArray[np.void]:
+        """
+        Interpolate TCA calibration for an array of focal lengths in one call.
+        
+        :param focal: focal lengths in mm
+        :return: structured array of the same shape with :data:`calib_tca_dtype`,
+                 entries without calibration data have model TCAModel.NONE
+        """
+        ...
+    
+    def interpolate_vignetting_array(
+        self,
+        focal: ArrayLike,
+        aperture: ArrayLike,
+        distance: ArrayLike
+    ) -> NDArray[np.void]:
+        """
+        Interpolate vignetting calibration for arrays of parameters in one call.
+        
+        :param focal: focal lengths in mm
+        :param aperture: apertures (f-number)
+        :param distance: focus distances in meters
+        :return: structured array of the broadcast shape with :data:`calib_vignetting_dtype`,
+                 entries without calibration data have model VignettingModel.NONE
+        """
+        ...
+    
     def __eq__(self, other: object) -> bool: ...
+    def __hash__(self) -> int: ...
     def __repr__(self) -> str: ...
 
 class Modifier:
@@ -514,7 +748,10 @@ class Modifier:
         xu: float = 0.0,
         yu: float = 0.0,
         width: int = -1,
-        height: int = -1
+        height: int = -1,
+        threads: int = 1,
+        out: Optional[NDArray[np.float32]] = None,
+        radial_lut: bool = False
     ) -> Optional[NDArray[np.float32]]:
         """
         Apply geometry distortion correction.
@@ -523,6 +760,12 @@ class Modifier:
         :param yu: Y coordinate of upper left corner
         :param width: width of the area to correct (-1 for full image)
         :param height: height of the area to correct (-1 for full image)
+        :param threads: number of threads to use, each computing a band of rows
+        :param out: float32 array of shape (height, width, 2) to write the result into,
+                    may be a view into a larger array as long as each row is contiguous
+        :param radial_lut: expand a lookup table of the radially symmetric correction instead of
+                           evaluating each pixel with lensfun, falls back to lensfun if the
+                           correction is not radial
         :return: coordinates for geometry distortion correction (height, width, 2),
                 or None if calibration data missing
         """
@@ -533,7 +776,10 @@ class Modifier:
         xu: float = 0.0,
         yu: float = 0.0,
         width: int = -1,
-        height: int = -1
+        height: int = -1,
+        threads: int = 1,
+        out: Optional[NDArray[np.float32]] = None,
+        radial_lut: bool = False
     ) -> Optional[NDArray[np.float32]]:
         """
         Apply subpixel distortion correction (for TCA).
@@ -542,6 +788,12 @@ class Modifier:
         :param yu: Y coordinate of upper left corner
         :param width: width of the area to correct (-1 for full image)
         :param height: height of the area to correct (-1 for full image)
+        :param threads: number of threads to use, each computing a band of rows
+        :param out: float32 array of shape (height, width, 3, 2) to write the result into,
+                    may be a view into a larger array as long as each row is contiguous
+        :param radial_lut: expand a lookup table of the radially symmetric correction instead of
+                           evaluating each pixel with lensfun, falls back to lensfun if the
+                           correction is not radial
         :return: per-channel coordinates for subpixel distortion correction (height, width, 3, 2),
                 or None if calibration data missing
         """
@@ -552,7 +804,10 @@ class Modifier:
         xu: float = 0.0,
         yu: float = 0.0,
         width: int = -1,
-        height: int = -1
+        height: int = -1,
+        threads: int = 1,
+        out: Optional[NDArray[np.float32]] = None,
+        radial_lut: bool = False
     ) -> Optional[NDArray[np.float32]]:
         """
         Apply combined geometry and subpixel distortion correction.
@@ -561,19 +816,161 @@ class Modifier:
         :param yu: Y coordinate of upper left corner
         :param width: width of the area to correct (-1 for full image)
         :param height: height of the area to correct (-1 for full image)
+        :param threads: number of threads to use, each computing a band of rows
+        :param out: float32 array of shape (height, width, 3, 2) to write the result into,
+                    may be a view into a larger array as long as each row is contiguous
+        :param radial_lut: expand a lookup table of the radially symmetric correction instead of
+                           evaluating each pixel with lensfun, falls back to lensfun if the
+                           correction is not radial
         :return: per-channel coordinates for combined distortion and subpixel distortion correction (height, width, 3, 2),
                 or None if calibration data missing
         """
         ...
     
+    def transform_points(
+        self,
+        pts: ArrayLike,
+        reverse: Optional[bool] = None,
+        out: Optional[NDArray[np.float32]] = None
+    ) -> Optional[NDArray[np.float32]]:
+        """
+        Apply geometry distortion correction to individual points.
+        
+        The transform is evaluated for all points in one native call, which is much
+        cheaper than computing a coordinate map of size 1x1 for each point.
+        
+        :param pts: (x, y) pixel coordinates (N, 2)
+        :param reverse: direction of the transform, None for the one given to :meth:`initialize`.
+                        With reverse=True, points in the distorted image are mapped to the corrected image.
+        :param out: C-contiguous float32 array of shape (N, 2) to write the result into
+        :return: transformed coordinates (N, 2), or None if calibration data missing
+        """
+        ...
+    
+    def transform_points_subpixel(
+        self,
+        pts: ArrayLike,
+        reverse: Optional[bool] = None,
+        out: Optional[NDArray[np.float32]] = None
+    ) -> Optional[NDArray[np.float32]]:
+        """
+        Apply subpixel distortion correction to individual points.
+        
+        The transform is evaluated for all points in one native call, which is much
+        cheaper than computing a coordinate map of size 1x1 for each point.
+        
+        :param pts: (x, y) pixel coordinates (N, 2)
+        :param reverse: direction of the transform, None for the one given to :meth:`initialize`.
+                        With reverse=True, points in the distorted image are mapped to the corrected image.
+        :param out: C-contiguous float32 array of shape (N, 3, 2) to write the result into
+        :return: transformed coordinates (N, 3, 2), or None if calibration data missing
+        """
+        ...
+    
+    def transform_points_subpixel_geometry(
+        self,
+        pts: ArrayLike,
+        reverse: Optional[bool] = None,
+        out: Optional[NDArray[np.float32]] = None
+    ) -> Optional[NDArray[np.float32]]:
+        """
+        Apply combined geometry and subpixel distortion correction to individual points.
+        
+        The transform is evaluated for all points in one native call, which is much
+        cheaper than computing a coordinate map of size 1x1 for each point.
+        
+        :param pts: (x, y) pixel coordinates (N, 2)
+        :param reverse: direction of the transform, None for the one given to :meth:`initialize`.
+                        With reverse=True, points in the distorted image are mapped to the corrected image.
+        :param out: C-contiguous float32 array of shape (N, 3, 2) to write the result into
+        :return: transformed coordinates (N, 3, 2), or None if calibration data missing
+        """
+        ...
+    
     def apply_color_modification(
         self,
-        img: NDArray[Any]
+        img: Any,
+        threads: int = 1,
+        comp_role: Optional[str] = None,
+        region: Optional[Tuple[int, int, int, int]] = None
     ) -> bool:
         """
         Apply vignetting correction to an image in place.
         
-        :param img: Image (h,w,3) for which to apply the vignetting correction, in place
+        The image is modified where it is, without copies. Rows may be anywhere in memory,
+        e.g. in a view of a larger image, as long as the components of each pixel are
+        adjacent and the pixels of a row are evenly spaced. Components between the ones of
+        a view, e.g. alpha in the RGB view ``rgba[..., :3]``, are left unchanged.
+        
+        :param img: writeable array or other object supporting the buffer protocol, of shape
+                    (h,w) or (h,w,c) and the dtype given as pixel format to :meth:`initialize`
+        :param threads: number of threads to use, each correcting a band of rows
+        :param comp_role: the role of each component of a pixel, one letter per channel:
+                          'R', 'G', 'B', 'I' (intensity) or 'X' (left unchanged), e.g. 'BGR'
+                          for OpenCV images or 'RGBX' for RGBA. By default 'I' for one channel,
+                          'RGB' for three and 'RGBX' for four channels.
+        :param region: (x, y, width, height) of the part of the image to correct.
+                       `img` is either the full image or only this part,
+                       e.g. a tile cut out of a larger image.
+        :return: true if vignetting correction was applied, otherwise false
+        """
+        ...
+    
+    def vignetting_gain(self, threads: int = 1) -> Optional[NDArray[np.float32]]:
+        """
+        Return the vignetting correction as a gain for each pixel.
+        
+        The gain is computed once per :meth:`initialize` and then cached. Multiplying a frame
+        with it, see :meth:`apply_vignetting_gain`, corrects vignetting like
+        :meth:`apply_color_modification` does, without evaluating the vignetting model
+        for each pixel of each frame, e.g. for videos and bursts shot with fixed settings.
+        
+        :param threads: number of threads to use when computing the gain
+        :return: read-only float32 array of shape (height, width),
+                 or None if there is no vignetting to correct
+        """
+        ...
+    
+    def apply_vignetting_gain(self, img: Any, threads: int = 1) -> bool:
+        """
+        Correct vignetting in place by multiplying each channel with :meth:`vignetting_gain`.
+        
+        Integer values are rounded and clipped to the range of the dtype.
+        Unlike :meth:`apply_color_modification`, the dtype need not match the pixel
+        format the modifier was initialized with. All channels are multiplied,
+        pass a view like ``rgba[..., :3]`` to leave alpha unchanged.
+        
+        :param img: image of shape (height, width) or (height, width, c) with unsigned integer
+                    or floating point dtype, in any memory layout
+        :param threads: number of threads to use, each correcting a band of rows
         :return: true if vignetting correction was applied, otherwise false
         """
         ...
+    
+    def correct(
+        self,
+        img: NDArray[Any],
+        out: Optional[NDArray[Any]] = None,
+        interpolation: str = 'linear',
+        yu: int = 0,
+        height: int = -1,
+        tile_rows: int = 64,
+        threads: int = 1
+    ) -> NDArray[Any]:
+        """
+        Correct vignetting, transverse chromatic aberration and geometric distortion in one pass.
+        
+        The output is computed tile by tile without allocating a full-frame coordinate map.
+        The input image is not modified.
+        
+        :param img: RGB image (h,w,3) to correct
+        :param out: C-contiguous array of shape (height,w,3) and the same dtype as the image
+                    to write the result into, allocated if None
+        :param interpolation: 'linear' or 'nearest'
+        :param yu: first output row to compute
+        :param height: number of output rows to compute (-1 for full image)
+        :param tile_rows: number of output rows per tile
+        :param threads: number of threads to use, each correcting a band of rows
+        :return: the corrected image (height,w,3)
+        """
+        ...
@@ -0,0 +1,327 @@
+"""
+asyncio counterparts of the blocking operations of lensfunpy.
+
+Correcting an image, computing a coordinate map or looking up a lens takes tens to
+hundreds of milliseconds, which would stall an event loop. The functions of this
+module run that work on an executor, a band of rows at a time. lensfun, OpenCV and
+SciPy release the GIL while working on a band, so the event loop keeps running.
+Awaiting tasks can be cancelled between bands. The band that is running when the
+task is cancelled still completes, and no further band is started.
+
+The executor must run its work in the calling process, e.g. a
+:class:`concurrent.futures.ThreadPoolExecutor`, since modifiers and images are
+passed to it as they are. By default the event loop's default executor is used.
+
+Concurrent requests are admitted by a :class:`MemoryBudget` according to the memory
+they allocate, so that a burst of requests for large images queues up instead
+of exhausting the memory.
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Deque, List, Optional, Tuple, TypeVar
+
+import numpy as np
+from numpy.typing import NDArray
+
+from lensfunpy import util
+from lensfunpy._lensfun import Camera, Database, Lens, Modifier
+from lensfunpy.maps import GridMap, HalfMap, FixedPointMap
+
+T = TypeVar('T')
+
+#: Default number of output rows processed per executor call.
+BAND_ROWS = 256
+
+class MemoryBudget:
+    """
+    Admits concurrent requests as long as the bytes they reserve fit into the budget.
+
+    Requests are admitted in the order they arrive. A request larger than the whole
+    budget is admitted once no other request holds a reservation, so it runs alone.
+    A budget may only be used from one event loop at a time.
+    """
+    def __init__(self, maxbytes: int = 1024**3) -> None:
+        """
+        :param int maxbytes: maximum number of bytes reserved at the same time
+        """
+        if maxbytes < 0:
+            raise ValueError('maxbytes must be >= 0')
+        self._maxbytes = maxbytes
+        self._inuse = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future[None]]] = deque()
+
+    @property
+    def maxbytes(self) -> int:
+        """
+        Maximum number of bytes reserved at the same time. May be changed while in use.
+        """
+        return self._maxbytes
+
+    @maxbytes.setter
+    def maxbytes(self, maxbytes: int) -> None:
+        if maxbytes < 0:
+            raise ValueError('maxbytes must be >= 0')
+        self._maxbytes = maxbytes
+        self._wake()
+
+    @property
+    def inuse(self) -> int:
+        """
+        Number of bytes currently reserved.
+        """
+        return self._inuse
+
+    @property
+    def waiting(self) -> int:
+        """
+        Number of requests waiting for their reservation.
+        """
+        return sum(1 for _, future in self._waiters if not future.done())
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int) -> AsyncIterator[None]:
+        """
+        Wait until `nbytes` fit into the budget and hold them until the block is left.
+
+        :param int nbytes: number of bytes to reserve
+        """
+        await self._acquire(nbytes)
+        try:
+            yield
+        finally:
+            self._release(nbytes)
+
+    def _fits(self, nbytes: int) -> bool:
+        return self._inuse == 0 or self._inuse + nbytes <= self._maxbytes
+
+    async def _acquire(self, nbytes: int) -> None:
+        if not self._waiters and self._fits(nbytes):
+            self._inuse += nbytes
+            return
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append((nbytes, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                # the request may have blocked the ones behind it
+                self._wake()
+            else:
+                # admitted just before the cancellation
+                self._release(nbytes)
+            raise
+
+    def _release(self, nbytes: int) -> None:
+        self._inuse -= nbytes
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters:
+            nbytes, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+            elif self._fits(nbytes):
+                self._waiters.popleft()
+                self._inuse += nbytes
+                future.set_result(None)
+            else:
+                break
+
+#: The default budget of all functions of this module, 1 GiB.
+memory_budget = MemoryBudget()
+
+async def _run(executor: Optional[Executor], func: Callable[..., T], *args: Any) -> T:
+    """
+    Run func(*args) on the executor. If the awaiting task is cancelled, wait for func
+    to return before passing on the cancellation, so that it does not write into
+    arrays which the caller already considers released.
+    """
+    future = asyncio.get_running_loop().run_in_executor(executor, partial(func, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
+
+def _bands(height: int, band_rows: int) -> List[Tuple[int, int]]:
+    if band_rows < 1:
+        raise ValueError('band_rows must be >= 1')
+    return [(y0, min(y0 + band_rows, height)) for y0 in range(0, height, band_rows)]
+
+async def correct(mod: Modifier, img: NDArray[Any], out: Optional[NDArray[Any]] = None,
+                  interpolation: str = 'linear', tile_rows: int = 64, threads: int = 1,
+                  band_rows: int = BAND_ROWS, executor: Optional[Executor] = None,
+                  budget: Optional[MemoryBudget] = None) -> NDArray[Any]:
+    """
+    Awaitable :meth:`lensfunpy.Modifier.correct`, computed `band_rows` output rows at a time.
+
+    The output image, if allocated, and one band of input rows are reserved in the budget.
+
+    :param lensfunpy.Modifier mod: modifier initialized with the pixel format of the image
+    :param ndarray img: RGB image (h,w,3) to correct
+    :param ndarray out: C-contiguous array of the shape and dtype of the image to write
+                        the result into, allocated if None
+    :param MemoryBudget budget: budget to reserve memory in, :data:`memory_budget` if None
+    :return: the corrected image
+    """
+    if budget is None:
+        budget = memory_budget
+    nbytes = band_rows * img.strides[0]
+    if out is None:
+        out = np.empty((mod.height, mod.width, 3), img.dtype)
+        nbytes += out.nbytes
+    if not out.flags.c_contiguous:
+        # bands of the output must be contiguous as well
+        raise ValueError('out must be C-contiguous')
+    async with budget.reserve(nbytes):
+        for y0, y1 in _bands(mod.height, band_rows):
+            await _run(executor, partial(mod.correct, img, out[y0:y1], interpolation, y0, y1 - y0,
+                                         tile_rows, threads))
+    return out
+
+def _coordsRows(coords: Any, y0: int, y1: int) -> Any:
+    if isinstance(coords, (GridMap, HalfMap)):
+        return coords.coords(y0, y1)
+    if isinstance(coords, FixedPointMap):
+        coords = coords.maps
+    if isinstance(coords, tuple):
+        return coords[0][y0:y1], coords[1][y0:y1]
+    return np.asarray(coords)[y0:y1]
+
+def _remapBand(im: NDArray[Any], coords: Any, out: NDArray[Any], y0: int, y1: int) -> None:
+    out[y0:y1] = util.remap(im, _coordsRows(coords, y0, y1))
+
+async def remap(im: NDArray[Any], coords: Any, out: Optional[NDArray[Any]] = None,
+                band_rows: int = BAND_ROWS, executor: Optional[Executor] = None,
+                budget: Optional[MemoryBudget] = None) -> NDArray[Any]:
+    """
+    Awaitable :func:`lensfunpy.util.remap`, computed `band_rows` output rows at a time.
+
+    The output image, if allocated, and the coordinates and result of one band are
+    reserved in the budget.
+
+    :param ndarray im: image to be remapped
+    :param coords: coordinates as for :func:`lensfunpy.util.remap`, including compact maps
+                   which are expanded one band at a time
+    :param ndarray out: array of shape (h,w,...) of the coordinates' height and width
+                        and the dtype of the image to write into, allocated if None
+    :param MemoryBudget budget: budget to reserve memory in, :data:`memory_budget` if None
+    :return: the remapped image
+    """
+    if budget is None:
+        budget = memory_budget
+    if isinstance(coords, FixedPointMap):
+        coords = coords.maps
+    if isinstance(coords, tuple):
+        shape = coords[1].shape[:2]
+    else:
+        if not isinstance(coords, (GridMap, HalfMap)):
+            coords = np.asarray(coords)
+        shape = coords.shape[:2]
+    height, width = shape
+    pixel_bytes = int(np.prod(im.shape[2:], dtype=np.int64)) * im.itemsize
+    nbytes = band_rows * width * (pixel_bytes + 3 * 2 * 4)
+    if out is None:
+        out = np.empty((height, width) + im.shape[2:], im.dtype)
+        nbytes += out.nbytes
+    async with budget.reserve(nbytes):
+        for y0, y1 in _bands(height, band_rows):
+            await _run(executor, _remapBand, im, coords, out, y0, y1)
+    return out
+
+async def _coordsMap(method: Callable[..., Optional[NDArray[np.float32]]], channels: Tuple[int, ...],
+                     mod: Modifier, xu: float, yu: float, width: int, height: int, threads: int,
+                     out: Optional[NDArray[np.float32]], radial_lut: bool, band_rows: int,
+                     executor: Optional[Executor], budget: Optional[MemoryBudget]) -> Optional[NDArray[np.float32]]:
+    if budget is None:
+        budget = memory_budget
+    if width < 0:
+        width = mod.width
+    if height < 0:
+        height = mod.height
+    nbytes = 0
+    if out is None:
+        out = np.empty((height, width) + channels, np.float32)
+        nbytes = out.nbytes
+    async with budget.reserve(nbytes):
+        for y0, y1 in _bands(height, band_rows):
+            coords = await _run(executor, partial(method, xu, yu + y0, width, y1 - y0, threads,
+                                                  out[y0:y1], radial_lut))
+            if coords is None:
+                return None
+    return out
+
+async def apply_geometry_distortion(mod: Modifier, xu: float = 0, yu: float = 0, width: int = -1, height: int = -1,
+                                    threads: int = 1, out: Optional[NDArray[np.float32]] = None,
+                                    radial_lut: bool = False, band_rows: int = BAND_ROWS,
+                                    executor: Optional[Executor] = None,
+                                    budget: Optional[MemoryBudget] = None) -> Optional[NDArray[np.float32]]:
+    """
+    Awaitable :meth:`lensfunpy.Modifier.apply_geometry_distortion`, computed `band_rows` rows at a time.
+    The result, if allocated, is reserved in the budget, :data:`memory_budget` if None.
+    """
+    return await _coordsMap(mod.apply_geometry_distortion, (2,), mod, xu, yu, width, height, threads,
+                            out, radial_lut, band_rows, executor, budget)
+
+async def apply_subpixel_distortion(mod: Modifier, xu: float = 0, yu: float = 0, width: int = -1, height: int = -1,
+                                    threads: int = 1, out: Optional[NDArray[np.float32]] = None,
+                                    radial_lut: bool = False, band_rows: int = BAND_ROWS,
+                                    executor: Optional[Executor] = None,
+                                    budget: Optional[MemoryBudget] = None) -> Optional[NDArray[np.float32]]:
+    """
+    Awaitable :meth:`lensfunpy.Modifier.apply_subpixel_distortion`, computed `band_rows` rows at a time.
+    The result, if allocated, is reserved in the budget, :data:`memory_budget` if None.
+    """
+    return await _coordsMap(mod.apply_subpixel_distortion, (3, 2), mod, xu, yu, width, height, threads,
+                            out, radial_lut, band_rows, executor, budget)
+
+async def apply_subpixel_geometry_distortion(mod: Modifier, xu: float = 0, yu: float = 0, width: int = -1,
+                                             height: int = -1, threads: int = 1,
+                                             out: Optional[NDArray[np.float32]] = None,
+                                             radial_lut: bool = False, band_rows: int = BAND_ROWS,
+                                             executor: Optional[Executor] = None,
+                                             budget: Optional[MemoryBudget] = None) -> Optional[NDArray[np.float32]]:
+    """
+    Awaitable :meth:`lensfunpy.Modifier.apply_subpixel_geometry_distortion`, computed `band_rows` rows at a time.
+    The result, if allocated, is reserved in the budget, :data:`memory_budget` if None.
+    """
+    return await _coordsMap(mod.apply_subpixel_geometry_distortion, (3, 2), mod, xu, yu, width, height, threads,
+                            out, radial_lut, band_rows, executor, budget)
+
+async def apply_color_modification(mod: Modifier, img: Any, threads: int = 1, comp_role: Optional[str] = None,
+                                   band_rows: int = BAND_ROWS, executor: Optional[Executor] = None) -> bool:
+    """
+    Awaitable :meth:`lensfunpy.Modifier.apply_color_modification` of a full image,
+    corrected in place `band_rows` rows at a time. Nothing is allocated, so no memory is reserved.
+    If cancelled, the image is only partly corrected.
+
+    :return: true if vignetting correction was applied, otherwise false
+    """
+    applied = False
+    for y0, y1 in _bands(mod.height, band_rows):
+        applied = await _run(executor, partial(mod.apply_color_modification, img, threads, comp_role,
+                                               (0, y0, mod.width, y1 - y0)))
+        if not applied:
+            break
+    return applied
+
+async def find_cameras(db: Database, maker: Optional[str] = None, model: Optional[str] = None,
+                       loose_search: bool = False, executor: Optional[Executor] = None) -> List[Camera]:
+    """
+    Awaitable :meth:`lensfunpy.Database.find_cameras`.
+    Database files still to be loaded by a lazy database are parsed on the executor.
+    """
+    return await _run(executor, db.find_cameras, maker, model, loose_search)
+
+async def find_lenses(db: Database, camera: Camera, maker: Optional[str] = None, lens: Optional[str] = None,
+                      loose_search: bool = False, executor: Optional[Executor] = None) -> List[Lens]:
+    """
+    Awaitable :meth:`lensfunpy.Database.find_lenses`.
+    Database files still to be loaded by a lazy database are parsed on the executor.
+    """
+    return await _run(executor, db.find_lenses, camera, maker, lens, loose_search)
@@ -0,0 +1,992 @@
+"""
+Caching of coordinate maps computed by :class:`lensfunpy.Modifier`.
+
+Computing a full-resolution map is expensive, while batch jobs typically
+process many frames with the same lens and shooting parameters.
+:class:`MapCache` keeps recently used maps in memory within a byte budget,
+:class:`MapStore` persists them on disk so that other processes can
+memory-map them instead of computing them again.
+
+:class:`GridMap`, :class:`HalfMap` and :class:`FixedPointMap` are compact
+representations of maps for caching and passing between processes, each
+recording the maximum error it introduced.
+
+:class:`FocalSequence` serves the frames of a zoom video, reusing and
+interpolating maps of nearby focal lengths.
+
+:class:`SharedMap` publishes a map in shared memory for worker processes to attach to.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import math
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+from multiprocessing import shared_memory
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+from lensfunpy._lensfun import Lens, Modifier, LensType, ModifyFlags, lensfun_version, _newFileMode
+
+#: The kinds of coordinate maps, named after the :class:`lensfunpy.Modifier` methods computing them.
+MAP_KINDS = ('geometry', 'subpixel', 'subpixel_geometry')
+
+MapKey = namedtuple('MapKey', ['lens', 'crop', 'width', 'height', 'focal', 'aperture', 'distance',
+                               'scale', 'targeom', 'flags', 'reverse', 'kind'])
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'currbytes', 'maxbytes'])
+
+def lens_key(lens: Lens) -> Tuple[Any, ...]:
+    """
+    A hashable identity of a lens which does not depend on the :class:`lensfunpy.Database`
+    instance the lens was found in. It includes a digest of the calibration data,
+    so that a lens overridden with other data gets another key.
+    """
+    return (lens.maker, lens.model, lens.min_focal, lens.max_focal, lens.crop_factor, _calibDigest(lens))
+
+def _calibDigest(lens: Lens) -> str:
+    # everything of a lens which the maps of a Modifier depend on, besides the key attributes
+    calibs = [lens.type.value, lens.center_x, lens.center_y]
+    for calib in lens.calib_distortion + lens.calib_tca + lens.calib_vignetting:
+        calibs.append([calib.model.value] + list(calib[1:-1]) + list(calib.terms))
+    return hashlib.sha1(json.dumps(calibs).encode('utf-8')).hexdigest()
+
+def _checkKind(kind: str) -> None:
+    if kind not in MAP_KINDS:
+        raise ValueError(f'kind must be one of {MAP_KINDS}, not {kind!r}')
+
+def _checkPositive(name: str, value: float) -> None:
+    # also rejects NaN
+    if not value > 0:
+        raise ValueError(f'{name} must be positive, not {value!r}')
+
+def _f32(value: float) -> float:
+    # Modifier parameters are single precision, values differing
+    # only beyond that result in identical maps.
+    return float(np.float32(value))
+
+def map_key(lens: Lens, crop: float, width: int, height: int, focal: float, aperture: float,
+            distance: float = 1000.0, scale: float = 0.0, targeom: LensType = LensType.RECTILINEAR,
+            flags: int = ModifyFlags.ALL, reverse: bool = False, kind: str = 'subpixel_geometry') -> MapKey:
+    """
+    The key identifying a coordinate map. See :meth:`MapCache.get` for parameters.
+    """
+    _checkKind(kind)
+    return MapKey(lens_key(lens), _f32(crop), int(width), int(height), _f32(focal), _f32(aperture),
+                  _f32(distance), _f32(scale), LensType(targeom).value, int(flags), bool(reverse), kind)
+
+def compute_map(lens: Lens, crop: float, width: int, height: int, focal: float, aperture: float,
+                distance: float = 1000.0, scale: float = 0.0, targeom: LensType = LensType.RECTILINEAR,
+                flags: int = ModifyFlags.ALL, reverse: bool = False, kind: str = 'subpixel_geometry',
+                threads: int = 1) -> Optional[NDArray[np.float32]]:
+    """
+    Compute a full-frame coordinate map without caching. See :meth:`MapCache.get` for parameters.
+    """
+    _checkKind(kind)
+    mod = Modifier(lens, crop, width, height)
+    mod.initialize(focal, aperture, distance, scale, LensType(targeom), flags=flags, reverse=reverse)
+    apply = getattr(mod, 'apply_' + kind + '_distortion')
+    coords: Optional[NDArray[np.float32]] = apply(threads=threads)
+    return coords
+
+class MapCache:
+    """
+    A thread-safe in-memory cache of coordinate maps with least-recently-used eviction.
+
+    Returned maps are shared between callers and therefore read-only.
+    """
+
+    def __init__(self, maxbytes: int = 1024**3, store: Optional[MapStore] = None) -> None:
+        """
+        :param int maxbytes: the maximum total size of all cached maps in bytes
+        :param lensfunpy.maps.MapStore store: if given, maps missing in memory are loaded from
+                                              this store, and newly computed maps are saved to it
+        """
+        self._maxbytes = maxbytes
+        self._store = store
+        self._maps: OrderedDict[MapKey, Optional[NDArray[np.float32]]] = OrderedDict()
+        self._currbytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def maxbytes(self) -> int:
+        """
+        The maximum total size of all cached maps in bytes.
+        Lowering it evicts maps until the cache fits again.
+        """
+        return self._maxbytes
+
+    @maxbytes.setter
+    def maxbytes(self, maxbytes: int) -> None:
+        with self._lock:
+            self._maxbytes = maxbytes
+            self._evict(0)
+
+    def get(self, lens: Lens, crop: float, width: int, height: int, focal: float, aperture: float,
+            distance: float = 1000.0, scale: float = 0.0, targeom: LensType = LensType.RECTILINEAR,
+            flags: int = ModifyFlags.ALL, reverse: bool = False, kind: str = 'subpixel_geometry',
+            threads: int = 1) -> Optional[NDArray[np.float32]]:
+        """
+        Return the coordinate map for the given parameters, computing it if not cached.
+
+        The parameters are the ones of :class:`lensfunpy.Modifier` and :meth:`lensfunpy.Modifier.initialize`.
+
+        :param str kind: which map to compute, one of 'geometry', 'subpixel', 'subpixel_geometry'
+                         (see :meth:`lensfunpy.Modifier.apply_subpixel_geometry_distortion` etc.)
+        :param int threads: number of threads to use when computing the map
+        :return: read-only coordinates, or None if calibration data missing
+        :rtype: ndarray of shape (height, width, 2) or (height, width, 3, 2) or None
+        """
+        key = map_key(lens, crop, width, height, focal, aperture, distance, scale,
+                      targeom, flags, reverse, kind)
+        with self._lock:
+            if key in self._maps:
+                self._hits += 1
+                self._maps.move_to_end(key)
+                return self._maps[key]
+            self._misses += 1
+
+        # computed outside the lock so that other maps can be served meanwhile
+        if self._store is not None:
+            coords = self._store.get(lens, crop, width, height, focal, aperture, distance, scale,
+                                     targeom, flags, reverse, kind, threads)
+        else:
+            coords = compute_map(lens, crop, width, height, focal, aperture, distance, scale,
+                                 targeom, flags, reverse, kind, threads)
+        self.put(key, coords)
+        return coords
+
+    def put(self, key: MapKey, coords: Optional[NDArray[np.float32]]) -> None:
+        """
+        Store a map under the given key (see :func:`map_key`).
+        The map is made read-only. Maps larger than :attr:`maxbytes` are not stored.
+        Memory-mapped maps count towards the budget like any other map.
+        """
+        if coords is not None:
+            coords.flags.writeable = False
+        nbytes = 0 if coords is None else coords.nbytes
+        with self._lock:
+            if nbytes > self._maxbytes:
+                return
+            if key in self._maps:
+                old = self._maps.pop(key)
+                self._currbytes -= 0 if old is None else old.nbytes
+            self._evict(nbytes)
+            self._maps[key] = coords
+            self._currbytes += nbytes
+
+    def _evict(self, nbytes: int) -> None:
+        while self._maps and self._currbytes + nbytes > self._maxbytes:
+            _, old = self._maps.popitem(last=False)
+            self._currbytes -= 0 if old is None else old.nbytes
+            self._evictions += 1
+
+    def cache_info(self) -> CacheInfo:
+        """
+        Hit, miss and eviction statistics, and the current and maximum size in bytes.
+
+        :rtype: :class:`CacheInfo`
+        """
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self._evictions, self._currbytes, self._maxbytes)
+
+    def clear(self) -> None:
+        """
+        Remove all maps and reset the statistics.
+        """
+        with self._lock:
+            self._maps.clear()
+            self._currbytes = 0
+            self._hits = self._misses = self._evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._maps)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._maps
+
+#: The default cache used by :func:`get_map`.
+map_cache = MapCache()
+
+def get_map(lens: Lens, crop: float, width: int, height: int, focal: float, aperture: float,
+            distance: float = 1000.0, scale: float = 0.0, targeom: LensType = LensType.RECTILINEAR,
+            flags: int = ModifyFlags.ALL, reverse: bool = False, kind: str = 'subpixel_geometry',
+            threads: int = 1) -> Optional[NDArray[np.float32]]:
+    """
+    Return a coordinate map from the module-level :data:`map_cache`.
+    See :meth:`MapCache.get` for parameters.
+    """
+    return map_cache.get(lens, crop, width, height, focal, aperture, distance, scale,
+                         targeom, flags, reverse, kind, threads)
+
+class MapStore:
+    """
+    A persistent store of coordinate maps as ``.npy`` files in a directory.
+
+    Maps are loaded memory-mapped and read-only, so pages are backed by the
+    operating system's page cache and shared between all processes on a host
+    which use the same map. Entries are written atomically and can therefore be
+    added by several processes concurrently.
+
+    The file name of a map is derived from its :func:`map_key` and the lensfun version.
+    As the key includes the calibration data of the lens, maps are computed again once
+    it changes, :meth:`clear` removes the outdated ones.
+
+    An ``index.json`` file in the directory describes the stored maps.
+    """
+
+    INDEX_FILENAME = 'index.json'
+
+    def __init__(self, directory: str) -> None:
+        """
+        :param str directory: the directory holding the maps, created if it does not exist
+        """
+        self._directory = os.path.abspath(directory)
+        os.makedirs(self._directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self) -> str:
+        """
+        The directory holding the maps.
+        """
+        return self._directory
+
+    def _name(self, key: MapKey) -> str:
+        ident = json.dumps([list(key), list(lensfun_version)])
+        return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+    def _path(self, name: str, ext: str) -> str:
+        return os.path.join(self._directory, name + ext)
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, MapKey):
+            return False
+        name = self._name(key)
+        return os.path.exists(self._path(name, '.npy')) or os.path.exists(self._path(name, '.none'))
+
+    def load(self, key: MapKey) -> Tuple[bool, Optional[NDArray[np.float32]]]:
+        """
+        Load a stored map.
+
+        :return: a (found, coords) tuple, where coords is a read-only memory-mapped
+                 array, or None if the map is not stored or calibration data was missing
+        :rtype: tuple of (bool, ndarray or None)
+        """
+        name = self._name(key)
+        try:
+            coords = np.load(self._path(name, '.npy'), mmap_mode='r')
+        except FileNotFoundError:
+            return os.path.exists(self._path(name, '.none')), None
+        return True, coords
+
+    def save(self, key: MapKey, coords: Optional[NDArray[np.float32]]) -> None:
+        """
+        Store a map, replacing any map stored under the same key.
+        None is stored as well, to remember that calibration data is missing.
+        """
+        name = self._name(key)
+        if coords is None:
+            self._write(name + '.none', lambda f: None)
+        else:
+            self._write(name + '.npy', lambda f: np.save(f, np.ascontiguousarray(coords)))
+        self._updateIndex(name, {'key': list(key), 'lensfun_version': list(lensfun_version),
+                                 'shape': None if coords is None else list(coords.shape)})
+
+    def get(self, lens: Lens, crop: float, width: int, height: int, focal: float, aperture: float,
+            distance: float = 1000.0, scale: float = 0.0, targeom: LensType = LensType.RECTILINEAR,
+            flags: int = ModifyFlags.ALL, reverse: bool = False, kind: str = 'subpixel_geometry',
+            threads: int = 1) -> Optional[NDArray[np.float32]]:
+        """
+        Return the stored map for the given parameters, computing and storing it if missing.
+        See :meth:`MapCache.get` for parameters.
+
+        :return: read-only memory-mapped coordinates, or None if calibration data missing
+        :rtype: ndarray of shape (height, width, 2) or (height, width, 3, 2) or None
+        """
+        key = map_key(lens, crop, width, height, focal, aperture, distance, scale,
+                      targeom, flags, reverse, kind)
+        found, coords = self.load(key)
+        if found:
+            return coords
+        coords = compute_map(lens, crop, width, height, focal, aperture, distance, scale,
+                             targeom, flags, reverse, kind, threads)
+        self.save(key, coords)
+        return self.load(key)[1]
+
+    def index(self) -> Dict[str, Any]:
+        """
+        The contents of the index file, mapping file names (without extension) to
+        the key, lensfun version and shape of each stored map.
+
+        :rtype: dict
+        """
+        try:
+            with open(os.path.join(self._directory, self.INDEX_FILENAME)) as f:
+                index: Dict[str, Any] = json.load(f)
+                return index
+        except FileNotFoundError:
+            return {}
+
+    def clear(self) -> None:
+        """
+        Remove all stored maps and the index.
+        Processes which memory-mapped a map can continue to use it.
+        """
+        with self._lock:
+            for filename in os.listdir(self._directory):
+                if filename.endswith(('.npy', '.none')) or filename == self.INDEX_FILENAME:
+                    os.remove(os.path.join(self._directory, filename))
+
+    def _updateIndex(self, name: str, entry: Dict[str, Any]) -> None:
+        # The index is informational only, lookups use the file names directly.
+        # Concurrent updates from other processes may therefore be lost without harm.
+        with self._lock:
+            index = self.index()
+            index[name] = entry
+            self._write(self.INDEX_FILENAME, lambda f: f.write(json.dumps(index, indent=1).encode('utf-8')))
+
+    def _write(self, filename: str, write: Any) -> None:
+        # write to a temporary file first, so that readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            # readable by the workers of other users as any other file
+            os.chmod(tmp_path, _newFileMode())
+            os.replace(tmp_path, os.path.join(self._directory, filename))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+_TRANSFORMS = {'geometry': 'transform_points', 'subpixel': 'transform_points_subpixel',
+               'subpixel_geometry': 'transform_points_subpixel_geometry'}
+
+def _rowRange(height: int, y0: int, y1: Optional[int]) -> Tuple[int, int]:
+    y1 = height if y1 is None else y1
+    if not 0 <= y0 <= y1 <= height:
+        raise ValueError(f'invalid row range [{y0}, {y1}) for a map of height {height}')
+    return y0, y1
+
+def _strips(coords: NDArray[Any], elements: int = 1 << 20) -> Iterator[Tuple[int, int]]:
+    # row ranges of about the given number of elements, to convert maps in cache-sized pieces
+    height = coords.shape[0]
+    rows = max(1, elements // max(1, coords[:1].size))
+    for y0 in range(0, height, rows):
+        yield y0, min(y0 + rows, height)
+
+def _identityOffsets(coords: NDArray[Any], y0: int) -> NDArray[np.float32]:
+    # pixel positions broadcastable against (rows, width, [3,] 2) coordinates
+    rows, width = coords.shape[0], coords.shape[1]
+    identity = np.empty((rows, width, 2), np.float32)
+    identity[..., 0] = np.arange(width, dtype=np.float32)
+    identity[..., 1] = np.arange(y0, y0 + rows, dtype=np.float32)[:, None]
+    if coords.ndim == 4:
+        identity = identity[:, :, None]
+    return identity
+
+def _gridNodes(size: int, step: int) -> int:
+    # the number of nodes covering pixels 0 to size - 1, at least two for interpolation
+    return max(-(-(size - 1) // step), 1) + 1
+
+def _interpRows(values: NDArray[Any], start: int, count: int, step: int, order: int,
+                stride: int = 1) -> NDArray[Any]:
+    """
+    Interpolate the rows of `values`, which are `step` pixels apart, linearly (order 1)
+    or with Catmull-Rom splines (order 3) at the pixel positions ``start + stride * k``
+    for ``k < count``. Each output row is a weighted sum of two or four input rows.
+    """
+    # extend the rows linearly, by one before the first and two after the last, so that
+    # row j is at index j + 1 and positions up to the last row need no clipping
+    rows = np.concatenate([2 * values[:1] - values[1:2], values,
+                           2 * values[-1:] - values[-2:-1], 3 * values[-1:] - 2 * values[-2:-1]])
+    rows = rows.reshape(len(rows), -1)
+    out = np.empty((count, rows.shape[1]), values.dtype)
+    for k in range(count):
+        j, phase = divmod(start + stride * k, step)
+        t = phase / step
+        if order == 1:
+            np.dot(np.array([1 - t, t], values.dtype), rows[j + 1:j + 3], out=out[k])
+        else:
+            t2, t3 = t * t, t * t * t
+            weights = np.array([-0.5 * t3 + t2 - 0.5 * t, 1.5 * t3 - 2.5 * t2 + 1,
+                                -1.5 * t3 + 2 * t2 + 0.5 * t, 0.5 * t3 - 0.5 * t2], values.dtype)
+            np.dot(weights, rows[j:j + 4], out=out[k])
+    return out.reshape((count,) + values.shape[1:])
+
+class GridMap:
+    """
+    A coordinate map stored as a coarse grid of control points, interpolated on use.
+
+    Maps are smooth, so sampling every `step` pixels and interpolating linearly or
+    with cubic splines reproduces them closely at a fraction of the size,
+    about ``1 / step**2``. The control points are computed with lensfun's per-point
+    evaluation (:meth:`lensfunpy.Modifier.transform_points` etc.). Note that lensfun's
+    full-frame maps deviate from it by up to about 0.2 pixels at high resolutions,
+    as they are accumulated in single precision.
+    """
+
+    def __init__(self, grid: NDArray[Any], step: int, width: int, height: int, order: int = 3,
+                 max_error: float = float('nan')) -> None:
+        """
+        :param grid: coordinates of the control points at pixel positions ``(i * step, j * step)``,
+                     of shape (rows, columns, 2) or (rows, columns, 3, 2) with at least
+                     ``ceil((height - 1) / step) + 1`` rows and the corresponding columns
+        :param int step: distance of the control points in pixels
+        :param int width: width of the map
+        :param int height: height of the map
+        :param int order: 1 for bilinear, 3 for bicubic (Catmull-Rom) interpolation
+        :param float max_error: the measured maximum error in pixels, see :attr:`max_error`
+        """
+        if order not in (1, 3):
+            raise ValueError(f'order must be 1 or 3, not {order!r}')
+        # lensfun computes single precision coordinates
+        self.grid = np.asarray(grid, np.float32)
+        rows, columns = _gridNodes(height, step), _gridNodes(width, step)
+        if self.grid.shape[0] < rows or self.grid.shape[1] < columns:
+            raise ValueError(f'grid of shape {self.grid.shape} does not cover a {width}x{height} map')
+        self.step = step
+        self.width = width
+        self.height = height
+        self.order = order
+        #: The maximum deviation from lensfun's per-point evaluation in pixels,
+        #: measured near the centers of the grid cells where the interpolation error is largest.
+        self.max_error = max_error
+
+    @classmethod
+    def from_modifier(cls, mod: Modifier, kind: str = 'subpixel_geometry', step: int = 16,
+                      order: int = 3) -> Optional[GridMap]:
+        """
+        Sample the map of an initialized modifier and measure the interpolation error.
+
+        :param lensfunpy.Modifier mod: the initialized modifier
+        :param str kind: which map to sample, one of 'geometry', 'subpixel', 'subpixel_geometry'
+        :param int step: distance of the control points in pixels
+        :param int order: 1 for bilinear, 3 for bicubic interpolation
+        :return: the grid map, or None if calibration data missing
+        """
+        _checkKind(kind)
+        transform = getattr(mod, _TRANSFORMS[kind])
+        width, height = mod.width, mod.height
+        xs = np.arange(_gridNodes(width, step)) * step
+        ys = np.arange(_gridNodes(height, step)) * step
+        grid = transform(np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2))
+        if grid is None:
+            return None
+        grid = grid.reshape((len(ys), len(xs)) + grid.shape[1:])
+        result = cls(grid, step, width, height, order)
+
+        # the interpolation error is largest near the centers of the grid cells
+        mid = step // 2
+        columns, rows = len(range(mid, width, step)), len(range(mid, height, step))
+        expected = transform(np.stack(np.meshgrid(mid + np.arange(columns) * step, mid + np.arange(rows) * step),
+                                      axis=-1).reshape(-1, 2))
+        interpolated = result._interpolate(mid, rows, mid, columns, step)
+        result.max_error = float(np.abs(interpolated.reshape(expected.shape) - expected).max()) if expected.size else 0.0
+        return result
+
+    def _interpolate(self, y0: int, rows: int, x0: int, columns: int, stride: int = 1) -> NDArray[Any]:
+        # the columns of the small grid first, in double precision, then the full rows
+        interpolated = _interpRows(np.swapaxes(self.grid, 0, 1).astype(np.float64), x0, columns,
+                                   self.step, self.order, stride)
+        interpolated = np.ascontiguousarray(np.swapaxes(interpolated, 0, 1), np.float32)
+        return _interpRows(interpolated, y0, rows, self.step, self.order, stride)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """
+        The shape of the full coordinate array.
+        """
+        return (self.height, self.width) + self.grid.shape[2:]
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The size of the control points in bytes.
+        """
+        return int(self.grid.nbytes)
+
+    def coords(self, y0: int = 0, y1: Optional[int] = None) -> NDArray[np.float32]:
+        """
+        Interpolate the coordinates of rows [y0, y1).
+
+        :return: coordinates of shape (y1 - y0, width, 2) or (y1 - y0, width, 3, 2)
+        """
+        y0, y1 = _rowRange(self.height, y0, y1)
+        coords: NDArray[np.float32] = self._interpolate(y0, y1 - y0, 0, self.width)
+        return coords
+
+    def __array__(self, dtype: Any = None, copy: Any = None) -> NDArray[Any]:
+        return self.coords().astype(dtype or np.float32, copy=False)
+
+class HalfMap:
+    """
+    A coordinate map stored as float16 offsets from the pixel positions,
+    half the size of float32 coordinates.
+
+    The precision of float16 is relative to the magnitude, the error is at most
+    ``2**-11`` times the largest offset, e.g. 0.03 pixels for offsets up to 64 pixels.
+    """
+
+    def __init__(self, offsets: NDArray[np.float16], max_error: float = float('nan')) -> None:
+        """
+        :param offsets: float16 array of shape (height, width, 2) or (height, width, 3, 2)
+                        holding the coordinates minus the pixel positions
+        :param float max_error: the measured maximum error in pixels, see :attr:`max_error`
+        """
+        self.offsets = np.asarray(offsets, np.float16)
+        #: The maximum deviation from the original coordinates in pixels.
+        self.max_error = max_error
+
+    @classmethod
+    def from_coords(cls, coords: NDArray[np.float32]) -> HalfMap:
+        """
+        Convert a coordinate map, as computed by :meth:`lensfunpy.Modifier.apply_geometry_distortion` etc.
+        """
+        coords = np.asarray(coords)
+        result = cls(np.empty(coords.shape, np.float16), 0.0)
+        for y0, y1 in _strips(coords):
+            strip = coords[y0:y1]
+            result.offsets[y0:y1] = strip - _identityOffsets(strip, y0)
+            result.max_error = max(result.max_error, float(np.abs(result.coords(y0, y1) - strip).max()))
+        return result
+
+    @classmethod
+    def from_modifier(cls, mod: Modifier, kind: str = 'subpixel_geometry', threads: int = 1) -> Optional[HalfMap]:
+        """
+        Compute and convert the map of an initialized modifier.
+
+        :return: the map, or None if calibration data missing
+        """
+        _checkKind(kind)
+        coords = getattr(mod, 'apply_' + kind + '_distortion')(threads=threads)
+        return None if coords is None else cls.from_coords(coords)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """
+        The shape of the full coordinate array.
+        """
+        return tuple(self.offsets.shape)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The size of the offsets in bytes.
+        """
+        return int(self.offsets.nbytes)
+
+    def coords(self, y0: int = 0, y1: Optional[int] = None) -> NDArray[np.float32]:
+        """
+        Restore the coordinates of rows [y0, y1).
+        """
+        y0, y1 = _rowRange(self.offsets.shape[0], y0, y1)
+        offsets = self.offsets[y0:y1]
+        coords: NDArray[np.float32] = offsets.astype(np.float32) + _identityOffsets(offsets, y0)
+        return coords
+
+    def __array__(self, dtype: Any = None, copy: Any = None) -> NDArray[Any]:
+        return self.coords().astype(dtype or np.float32, copy=False)
+
+#: The number of fractional bits of :class:`FixedPointMap` coordinates, as in OpenCV.
+INTER_BITS = 5
+
+def fixed_point_coords(map1: NDArray[np.int16], map2: NDArray[np.uint16]) -> NDArray[np.float32]:
+    """
+    Convert OpenCV fixed-point maps back to float32 coordinates.
+
+    :param map1: integer parts of shape (h,w,2) or (h,w,3,2)
+    :param map2: fractional parts of shape (h,w) or (h,w,3), see :class:`FixedPointMap`
+    :return: coordinates of shape (h,w,2) or (h,w,3,2)
+    """
+    scale = np.float32(1 << INTER_BITS)
+    mask = (1 << INTER_BITS) - 1
+    coords = map1.astype(np.float32)
+    coords[..., 0] += (map2 & mask) / scale
+    coords[..., 1] += (map2 >> INTER_BITS) / scale
+    return coords
+
+class FixedPointMap:
+    """
+    A coordinate map in OpenCV's fixed-point format, as produced by
+    ``cv2.convertMaps(coords, None, cv2.CV_16SC2)``: ``map1`` holds the int16 integer parts
+    of the coordinates, ``map2`` the uint16 index ``(y_frac << 5) | x_frac`` of the fractional
+    parts in units of 1/32 pixel. :func:`lensfunpy.util.remap` passes them to OpenCV directly,
+    which then skips the conversion it would otherwise do internally.
+
+    Coordinates are rounded to 1/32 pixel, the error is at most 1/64 pixel.
+    Coordinates beyond the int16 range are saturated, they lie outside of any image anyway.
+    Per-channel maps are stored as one map per channel, map1 of shape (h,w,3,2) and map2 of shape (h,w,3).
+    """
+
+    def __init__(self, map1: NDArray[np.int16], map2: NDArray[np.uint16], max_error: float = float('nan')) -> None:
+        """
+        :param map1: integer parts of shape (h,w,2) or (h,w,3,2)
+        :param map2: fractional parts of shape (h,w) or (h,w,3)
+        :param float max_error: the measured maximum error in pixels, see :attr:`max_error`
+        """
+        self.map1 = np.asarray(map1, np.int16)
+        self.map2 = np.asarray(map2, np.uint16)
+        if self.map1.shape != self.map2.shape + (2,):
+            raise ValueError(f'map1 of shape {self.map1.shape} does not match map2 of shape {self.map2.shape}')
+        #: The maximum deviation from the original coordinates within the int16 range in pixels.
+        self.max_error = max_error
+
+    @classmethod
+    def from_coords(cls, coords: NDArray[np.float32]) -> FixedPointMap:
+        """
+        Convert a coordinate map, as computed by :meth:`lensfunpy.Modifier.apply_geometry_distortion` etc.
+        """
+        coords = np.asarray(coords)
+        limit = 1 << (15 + INTER_BITS)
+        mask = (1 << INTER_BITS) - 1
+        result = cls(np.empty(coords.shape, np.int16), np.empty(coords.shape[:-1], np.uint16), 0.0)
+        for y0, y1 in _strips(coords):
+            strip = coords[y0:y1]
+            scaled = np.rint(np.nan_to_num(strip * np.float32(1 << INTER_BITS), nan=-limit))
+            fixed = np.clip(scaled, -limit, limit - 1).astype(np.int32)
+            result.map1[y0:y1] = fixed >> INTER_BITS
+            result.map2[y0:y1] = ((fixed[..., 1] & mask) << INTER_BITS) | (fixed[..., 0] & mask)
+            error = np.abs(result.coords(y0, y1) - strip)[np.abs(strip) < limit >> INTER_BITS]
+            if error.size:
+                result.max_error = max(result.max_error, float(error.max()))
+        return result
+
+    @classmethod
+    def from_modifier(cls, mod: Modifier, kind: str = 'subpixel_geometry',
+                      threads: int = 1) -> Optional[FixedPointMap]:
+        """
+        Compute and convert the map of an initialized modifier.
+
+        :return: the map, or None if calibration data missing
+        """
+        _checkKind(kind)
+        coords = getattr(mod, 'apply_' + kind + '_distortion')(threads=threads)
+        return None if coords is None else cls.from_coords(coords)
+
+    @property
+    def maps(self) -> Tuple[NDArray[np.int16], NDArray[np.uint16]]:
+        """
+        The (map1, map2) tuple as passed to ``cv2.remap``.
+        """
+        return self.map1, self.map2
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """
+        The shape of the full coordinate array.
+        """
+        return tuple(self.map1.shape)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The size of both maps in bytes.
+        """
+        return int(self.map1.nbytes + self.map2.nbytes)
+
+    def coords(self, y0: int = 0, y1: Optional[int] = None) -> NDArray[np.float32]:
+        """
+        Restore the coordinates of rows [y0, y1).
+        """
+        y0, y1 = _rowRange(self.map1.shape[0], y0, y1)
+        return fixed_point_coords(self.map1[y0:y1], self.map2[y0:y1])
+
+    def __array__(self, dtype: Any = None, copy: Any = None) -> NDArray[Any]:
+        return self.coords().astype(dtype or np.float32, copy=False)
+
+#: Any of the compact map types.
+CompactMap = Union[GridMap, HalfMap, FixedPointMap]
+
+class FocalSequence:
+    """
+    Coordinate maps and vignetting gains for a sequence of frames whose focal length,
+    aperture and distance change from frame to frame, e.g. zoom video.
+
+    Maps are only computed at focal lengths on a geometric grid with a spacing of
+    `focal_tolerance`, relative to the focal length, and kept in a :class:`MapCache`.
+    The map of a frame is interpolated between the maps of the two neighbouring grid
+    focal lengths, or with ``interpolate=False`` the map of the nearest one is returned.
+    Frames with an unchanged focal length get the same map without any computation.
+    Distortion and TCA depend on the focal length only, vignetting gains are computed
+    at the nearest grid values of focal length, aperture and distance.
+
+    Interpolated maps are close to the exact ones, e.g. within 0.04 pixels for a tolerance
+    of 2% at 1920x1080, while nearest maps may deviate by about a pixel. This assumes a fixed
+    `scale`: the automatic scale (0) changes with the focal length in steps, which
+    interpolation does not follow exactly. A fixed scale also keeps the framing steady.
+    """
+
+    def __init__(self, lens: Lens, crop: float, width: int, height: int, kind: str = 'subpixel_geometry',
+                 focal_tolerance: float = 0.02, aperture_tolerance: float = 0.05,
+                 distance_tolerance: float = 0.05, interpolate: bool = True,
+                 scale: float = 0.0, targeom: LensType = LensType.RECTILINEAR,
+                 flags: int = ModifyFlags.ALL, reverse: bool = False, threads: int = 1,
+                 cache: Optional[MapCache] = None, gain_cache_size: int = 8) -> None:
+        """
+        The parameters are the ones of :class:`lensfunpy.Modifier` and :meth:`lensfunpy.Modifier.initialize`.
+
+        :param str kind: which maps to compute, one of 'geometry', 'subpixel', 'subpixel_geometry'
+        :param float focal_tolerance: relative spacing of the focal lengths maps are computed at
+        :param float aperture_tolerance: relative spacing of the apertures vignetting gains are computed at
+        :param float distance_tolerance: relative spacing of the distances vignetting gains are computed at
+        :param bool interpolate: whether to interpolate maps between grid focal lengths
+        :param int threads: number of threads to use when computing a map
+        :param lensfunpy.maps.MapCache cache: cache for the maps at grid focal lengths,
+                                              by default a new cache of 1 GiB
+        :param int gain_cache_size: number of vignetting gains to keep
+        """
+        _checkKind(kind)
+        _checkPositive('focal_tolerance', focal_tolerance)
+        _checkPositive('aperture_tolerance', aperture_tolerance)
+        _checkPositive('distance_tolerance', distance_tolerance)
+        self._lens = lens
+        self._crop = crop
+        self._width = width
+        self._height = height
+        self._kind = kind
+        self._tolerances = (focal_tolerance, aperture_tolerance, distance_tolerance)
+        self._interpolate = interpolate
+        self._scale = scale
+        self._targeom = targeom
+        self._flags = flags
+        self._reverse = reverse
+        self._threads = threads
+        self._cache = cache if cache is not None else MapCache()
+        self._gains: OrderedDict[Tuple[float, ...], Optional[NDArray[np.float32]]] = OrderedDict()
+        self._gain_cache_size = gain_cache_size
+        self._modifier: Optional[Modifier] = None
+        self._last: Optional[Tuple[float, Optional[NDArray[np.float32]]]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self) -> MapCache:
+        """
+        The cache holding the maps at grid focal lengths.
+        """
+        return self._cache
+
+    @staticmethod
+    def _grid(value: float, tolerance: float) -> float:
+        # grid position of a value, whose integer values are the grid points
+        return math.log(value) / math.log1p(tolerance)
+
+    @staticmethod
+    def _value(position: int, tolerance: float) -> float:
+        return _f32(math.exp(position * math.log1p(tolerance)))
+
+    def _clampFocal(self, focal: float, grid_focal: float) -> float:
+        # the corrections change abruptly at the ends of the focal range of a zoom lens,
+        # grid focal lengths beyond them are replaced by the ends for focal lengths within
+        min_focal, max_focal = self._lens.min_focal, self._lens.max_focal
+        if min_focal <= focal <= max_focal:
+            return min(max(grid_focal, _f32(min_focal)), _f32(max_focal))
+        return grid_focal
+
+    def _gridMap(self, focal: float) -> Optional[NDArray[np.float32]]:
+        # aperture and distance do not affect maps, fixed values share the cache entries
+        return self._cache.get(self._lens, self._crop, self._width, self._height, focal, 8.0, 1000.0,
+                               self._scale, self._targeom, self._flags, self._reverse, self._kind,
+                               self._threads)
+
+    def coords(self, focal: float) -> Optional[NDArray[np.float32]]:
+        """
+        Return the coordinate map of a frame.
+
+        :param float focal: the focal length of the frame in mm
+        :return: read-only coordinates, or None if calibration data missing
+        :rtype: ndarray of shape (height, width, 2) or (height, width, 3, 2) or None
+        """
+        _checkPositive('focal', focal)
+        focal = _f32(focal)
+        last = self._last
+        if last is not None and last[0] == focal:
+            return last[1]
+        tolerance = self._tolerances[0]
+        position = self._grid(focal, tolerance)
+        lower = self._clampFocal(focal, self._value(math.floor(position), tolerance))
+        upper = self._clampFocal(focal, self._value(math.floor(position) + 1, tolerance))
+        t = math.log(focal / lower) / math.log(upper / lower) if upper > lower else 0.0
+        if not self._interpolate or t < 1e-6 or t > 1 - 1e-6:
+            coords = self._gridMap(lower if t < 0.5 else upper)
+        else:
+            lower_coords = self._gridMap(lower)
+            upper_coords = self._gridMap(upper)
+            if lower_coords is None or upper_coords is None:
+                coords = lower_coords if upper_coords is None else upper_coords
+            else:
+                coords = np.subtract(upper_coords, lower_coords)
+                coords *= np.float32(t)
+                coords += lower_coords
+                coords.flags.writeable = False
+        self._last = (focal, coords)
+        return coords
+
+    def vignetting_gain(self, focal: float, aperture: float, distance: float = 1000.0) -> Optional[NDArray[np.float32]]:
+        """
+        Return the vignetting gain of a frame, see :meth:`lensfunpy.Modifier.vignetting_gain`,
+        computed at the nearest grid values of the parameters.
+
+        :return: read-only float32 gain of shape (height, width), or None if there is no vignetting to correct
+        """
+        _checkPositive('focal', focal)
+        _checkPositive('aperture', aperture)
+        _checkPositive('distance', distance)
+        key = tuple(self._value(round(self._grid(value, tolerance)), tolerance)
+                    for value, tolerance in zip((focal, aperture, distance), self._tolerances))
+        with self._lock:
+            if key in self._gains:
+                self._gains.move_to_end(key)
+                return self._gains[key]
+            if self._modifier is None:
+                self._modifier = Modifier(self._lens, self._crop, self._width, self._height)
+            self._modifier.initialize(key[0], key[1], key[2], self._scale, self._targeom,
+                                      flags=self._flags, reverse=self._reverse)
+            gain = self._modifier.vignetting_gain(self._threads)
+            self._gains[key] = gain
+            while len(self._gains) > self._gain_cache_size:
+                self._gains.popitem(last=False)
+            return gain
+
+def _attachSharedMemory(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        # the creating process is responsible for unlinking the block
+        return shared_memory.SharedMemory(name, track=False)
+    return shared_memory.SharedMemory(name)
+
+class SharedMap:
+    """
+    A coordinate map in a :mod:`multiprocessing.shared_memory` block.
+
+    Pickling a shared map only transfers the name, shape and dtype of the block, workers
+    unpickling it attach to the block and read the map without copying it.
+    The process that published the map owns the block and must unlink it, e.g. by using the map
+    as a context manager, once no worker needs it anymore. Other processes only close it.
+    With Python < 3.13, only processes started by the owner, e.g. the workers of a
+    :class:`concurrent.futures.ProcessPoolExecutor`, should attach, as otherwise the
+    block is unlinked when the first attached process exits.
+    """
+
+    def __init__(self, name: str, shape: Tuple[int, ...], dtype: Any = np.float32) -> None:
+        """
+        Attach to the shared map published under `name`.
+
+        :param str name: name of the shared memory block, see :attr:`name`
+        :param tuple shape: shape of the map
+        :param dtype: dtype of the map
+        """
+        self._setup(_attachSharedMemory(name), shape, dtype, owner=False)
+
+    def _setup(self, shm: shared_memory.SharedMemory, shape: Tuple[int, ...], dtype: Any, owner: bool) -> None:
+        self._shm = shm
+        self._owner = owner
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        self._array: Optional[NDArray[Any]] = self._view()
+
+    def _view(self) -> NDArray[Any]:
+        array: NDArray[Any] = np.ndarray(self._shape, self._dtype, buffer=self._shm.buf)
+        array.flags.writeable = False
+        return array
+
+    @classmethod
+    def publish(cls, coords: Any) -> SharedMap:
+        """
+        Copy a map into a new shared memory block owned by this process.
+
+        :param coords: coordinate array as computed by :meth:`lensfunpy.Modifier.apply_geometry_distortion`
+                       etc., or a compact map which is expanded
+        """
+        coords = np.asarray(coords)
+        shm = shared_memory.SharedMemory(create=True, size=max(coords.nbytes, 1))
+        try:
+            np.ndarray(coords.shape, coords.dtype, buffer=shm.buf)[...] = coords
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        result = cls.__new__(cls)
+        result._setup(shm, coords.shape, coords.dtype, owner=True)
+        return result
+
+    @property
+    def name(self) -> str:
+        """
+        The name of the shared memory block.
+        """
+        return str(self._shm.name)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """
+        The shape of the coordinate array.
+        """
+        return self._shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        """
+        The dtype of the coordinate array.
+        """
+        return self._dtype
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The size of the map in bytes.
+        """
+        return int(np.prod(self._shape, dtype=np.int64)) * self._dtype.itemsize
+
+    def coords(self, y0: int = 0, y1: Optional[int] = None) -> NDArray[Any]:
+        """
+        A read-only view of the coordinates of rows [y0, y1) in shared memory.
+        Views must be released before the map is closed.
+        """
+        if self._array is None:
+            raise ValueError('shared map is closed')
+        y0, y1 = _rowRange(self._shape[0], y0, y1)
+        return self._array[y0:y1]
+
+    def __array__(self, dtype: Any = None, copy: Any = None) -> NDArray[Any]:
+        return self.coords().astype(dtype or self._dtype, copy=False)
+
+    def close(self) -> None:
+        """
+        Detach from the block. Raises :class:`BufferError` while views of the map exist.
+        """
+        if self._array is None:
+            return
+        self._array = None
+        try:
+            self._shm.close()
+        except BufferError:
+            self._array = self._view()
+            raise
+
+    def unlink(self) -> None:
+        """
+        Close the map and, if this process published it, free the block
+        once all other processes have closed it.
+        """
+        self.close()
+        if self._owner:
+            self._owner = False
+            self._shm.unlink()
+
+    def __enter__(self) -> SharedMap:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.unlink()
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return SharedMap, (self.name, self._shape, self._dtype.str)
@@ -1,8 +1,15 @@
 from __future__ import print_function, division, absolute_import
 
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
 import numpy as np
 
-from scipy.ndimage.interpolation import map_coordinates
+from scipy.ndimage import map_coordinates
+
+import lensfunpy
+from lensfunpy.maps import FixedPointMap, fixed_point_coords
 try:
     import cv2
 except ImportError:
@@ -17,46 +24,359 @@ def remapOpenCv(im, coords):
     im = np.require(im, im.dtype, 'C')
     return cv2.remap(im, coords, None, cv2.INTER_LANCZOS4)
 
-def remapScipy(im, coords):
+def remapScipy(im, coords, strip_rows=None):
     """
     Remap an image using SciPy. See :func:`remap` for parameters.
+    
+    Each channel is interpolated separately, one strip of output rows at a time,
+    using a single float32 coordinate buffer for all strips and channels.
+    Apart from the output image, peak memory is therefore bounded by
+    ``2 * strip_rows * width * 4`` bytes.
+    
+    :param int strip_rows: number of output rows per strip,
+                           by default chosen such that the coordinate buffer is about 16 MiB
     """
-    height, width = im.shape[0], im.shape[1]
+    height, width = coords.shape[0], coords.shape[1]
+    if strip_rows is None:
+        strip_rows = max(1, (16 * 1024**2) // (2 * 4 * width))
+    strip_rows = min(strip_rows, height)
     
-    # switch to y,x order
-    coords = coords[:,:,::-1]
+    out = np.empty((height, width) + im.shape[2:], im.dtype)
+    # the last axis of a grayscale image is added so that all images
+    # can be handled as (h, w, channels) views
+    im_channels = im.reshape(im.shape[:2] + (-1,))
+    out_channels = out.reshape((height, width, -1))
+    
+    coords_yx = np.empty((2, strip_rows, width), np.float32)
+    for y0, y1, strip in _coordsStripsYX(coords, coords_yx):
+        for c in range(im_channels.shape[2]):
+            map_coordinates(im_channels[:, :, c], strip, order=1,
+                            output=out_channels[y0:y1, :, c])
+    return out
+
+def _coordsStripsYX(coords, coords_yx):
+    """
+    Iterate over strips of an (h, w, 2) coordinate array, yielding (y0, y1, strip) where
+    strip is the part of the (2, strip_rows, w) buffer `coords_yx` holding the coordinates
+    of rows y0 to y1 in y,x order as expected by map_coordinates.
+    """
+    height, strip_rows = coords.shape[0], coords_yx.shape[1]
+    for y0 in range(0, height, strip_rows):
+        y1 = min(y0 + strip_rows, height)
+        strip = coords_yx[:, :y1 - y0]
+        strip[0] = coords[y0:y1, :, 1]
+        strip[1] = coords[y0:y1, :, 0]
+        yield y0, y1, strip
 
-    # make it (h, w, 3, 3)
-    coords_channels = np.empty((height, width, 3, 3))
-    coords_channel = np.zeros((height, width, 3))
-    coords_channel[:,:,:2] = coords
-    coords_channels[:,:,0] = coords_channel
-    coords_channels[:,:,1] = coords_channel
-    coords_channels[:,:,1,2] = 1
-    coords_channels[:,:,2] = coords_channel
-    coords_channels[:,:,2,2] = 2
-    coords = coords_channels
+def remapSubpixel(im, coords, out=None, strip_rows=None):
+    """
+    Remap an RGB image using separate target coordinates for each channel.
+    
+    This is used to correct transverse chromatic aberration, with the coordinates
+    computed by :meth:`lensfunpy.Modifier.apply_subpixel_distortion` or
+    :meth:`lensfunpy.Modifier.apply_subpixel_geometry_distortion`.
+    The three channels are remapped concurrently, with OpenCV or SciPy
+    releasing the GIL, and written directly into a single interleaved output array.
+    If available, OpenCV is used (faster), otherwise SciPy.
     
-    # (3, h, w, 3)
-    coords = np.rollaxis(coords, 3)
-        
-    return map_coordinates(im, coords, order=1)
+    :type im: ndarray of shape (h,w,3)
+    :param im: RGB image to be remapped
+    :type coords: ndarray of shape (h,w,3,2)
+    :param coords: target coordinates in x,y order for each pixel and channel
+    :type out: ndarray of shape (h,w,3)
+    :param out: array to write the remapped image into, allocated if None
+    :param int strip_rows: number of output rows remapped at once per channel,
+                           by default chosen such that the coordinate buffer of each channel
+                           is about 16 MiB
+    :return: remapped RGB image
+    :rtype: ndarray of shape (h,w,3)
+    """
+    height, width = coords.shape[0], coords.shape[1]
+    if coords.shape[2:] != (3, 2) or im.ndim != 3 or im.shape[2] != 3:
+        raise ValueError('image must be of shape (h,w,3) and coordinates of shape (h,w,3,2)')
+    if out is None:
+        out = np.empty((height, width, 3), im.dtype)
+    if strip_rows is None:
+        strip_rows = max(1, (16 * 1024**2) // (2 * 4 * width))
+    strip_rows = min(strip_rows, height)
+    
+    remapChannel = _remapChannelOpenCv if cv2 else _remapChannelScipy
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(remapChannel, im[:, :, c], coords[:, :, c], out[:, :, c], strip_rows)
+                   for c in range(3)]
+        for future in futures:
+            future.result()
+    return out
+
+def _remapChannelOpenCv(im_channel, coords, out_channel, strip_rows):
+    # OpenCV needs contiguous arrays, so the channel and each strip
+    # of its coordinates are copied first
+    im_channel = np.ascontiguousarray(im_channel)
+    for y0 in range(0, coords.shape[0], strip_rows):
+        y1 = min(y0 + strip_rows, coords.shape[0])
+        out_channel[y0:y1] = cv2.remap(im_channel, np.ascontiguousarray(coords[y0:y1]),
+                                       None, cv2.INTER_LANCZOS4)
+
+def _remapChannelScipy(im_channel, coords, out_channel, strip_rows):
+    coords_yx = np.empty((2, strip_rows, coords.shape[1]), np.float32)
+    for y0, y1, strip in _coordsStripsYX(coords, coords_yx):
+        map_coordinates(im_channel, strip, order=1, output=out_channel[y0:y1])
+
+def remapFixedPoint(im, map1, map2):
+    """
+    Remap an image using OpenCV fixed-point maps, see :class:`lensfunpy.maps.FixedPointMap`.
+    
+    With OpenCV, the maps are used directly, otherwise they are converted
+    back to float coordinates and the image is remapped with SciPy.
+    
+    :type im: ndarray of shape (h,w) or (h,w,3)
+    :param im: image to be remapped
+    :type map1: int16 ndarray of shape (h,w,2) or (h,w,3,2)
+    :param map1: integer parts of the coordinates (for each channel)
+    :type map2: uint16 ndarray of shape (h,w) or (h,w,3)
+    :param map2: fractional parts of the coordinates (for each channel)
+    :return: remapped image
+    """
+    if not cv2:
+        return remap(im, fixed_point_coords(map1, map2))
+    if map1.ndim == 3:
+        im = np.require(im, im.dtype, 'C')
+        return cv2.remap(im, map1, map2, cv2.INTER_LANCZOS4)
+    if im.ndim != 3 or im.shape[2] != 3:
+        raise ValueError('image must be of shape (h,w,3) for per-channel maps')
+    out = np.empty(map2.shape, im.dtype)
+    for c in range(3):
+        out[:, :, c] = cv2.remap(np.ascontiguousarray(im[:, :, c]), np.ascontiguousarray(map1[:, :, c]),
+                                 np.ascontiguousarray(map2[:, :, c]), cv2.INTER_LANCZOS4)
+    return out
 
 def remap(im, coords):
     """
     Remap an RGB image using the given target coordinate array.
     
     If available, OpenCV is used (faster), otherwise SciPy.
+    Per-channel coordinates are handled by :func:`remapSubpixel`,
+    fixed-point maps by :func:`remapFixedPoint`.
     
     :type im: ndarray of shape (h,w,3)
     :param im: RGB image to be remapped
-    :type coords: ndarray of shape (h,w,2)
-    :param coords: target coordinates in x,y order for each pixel
+    :type coords: ndarray of shape (h,w,2) or (h,w,3,2), a compact map of :mod:`lensfunpy.maps`,
+                  or a (map1, map2) tuple of OpenCV fixed-point maps
+    :param coords: target coordinates in x,y order for each pixel (and channel)
     :return: remapped RGB image
     :rtype: ndarray of shape (h,w,3)
     """
+    if isinstance(coords, FixedPointMap):
+        coords = coords.maps
+    if isinstance(coords, tuple):
+        return remapFixedPoint(im, *coords)
+    coords = np.asarray(coords)
+    if coords.ndim == 4:
+        return remapSubpixel(im, coords)
     if cv2:
         return remapOpenCv(im, coords)
     else:
         return remapScipy(im, coords)
-    
\ No newline at end of file
+    
+# Number of extra input rows needed on each side of the sampled range,
+# enough for the widest interpolation kernel (OpenCV's Lanczos4).
+_KERNEL_PAD = 4
+
+def remapBands(im, mod, out=None, band_rows=256, subpixel=False):
+    """
+    Correct the geometric distortion of an image one band of output rows at a time.
+    
+    For each band, the coordinates are computed with :meth:`lensfunpy.Modifier.apply_geometry_distortion`,
+    and only the input rows that the band samples from are read and remapped.
+    This allows to correct images larger than the available memory, for example
+    when `im` and `out` are :class:`numpy.memmap` arrays. Apart from the input
+    rows the band depends on, peak memory is bounded by the band size,
+    not the image size.
+    
+    :type im: ndarray of shape (h,w) or (h,w,c)
+    :param im: image to be remapped, of the size the modifier was created for
+    :param lensfunpy.Modifier mod: initialized modifier
+    :type out: ndarray of same shape and dtype as im
+    :param out: array to write the remapped image into, allocated if None
+    :param int band_rows: number of output rows per band
+    :param bool subpixel: whether to also correct transverse chromatic aberration of an RGB image
+                          using :meth:`lensfunpy.Modifier.apply_subpixel_geometry_distortion`
+    :return: out, the remapped image
+    """
+    height, width = mod.height, mod.width
+    if im.shape[:2] != (height, width):
+        raise ValueError(f'image must be of shape ({height}, {width}, ...) as given to the modifier')
+    if out is None:
+        out = np.empty_like(im)
+    
+    if subpixel:
+        coords_buffer = np.empty((min(band_rows, height), width, 3, 2), np.float32)
+        apply = mod.apply_subpixel_geometry_distortion
+    else:
+        coords_buffer = np.empty((min(band_rows, height), width, 2), np.float32)
+        apply = mod.apply_geometry_distortion
+    for y0 in range(0, height, band_rows):
+        y1 = min(y0 + band_rows, height)
+        coords = apply(0, y0, width, y1 - y0, out=coords_buffer[:y1 - y0])
+        if coords is None:
+            # no calibration data, nothing to correct
+            out[y0:y1] = im[y0:y1]
+            continue
+        r0, r1 = _sourceRows(coords[...,1], height)
+        if r0 >= r1:
+            # the band samples outside of the image only
+            out[y0:y1] = 0
+            continue
+        coords[...,1] -= r0
+        out[y0:y1] = remap(np.asarray(im[r0:r1]), coords)
+    return out
+
+def _sourceRows(ys, height):
+    """
+    The range of input rows [r0, r1) needed to interpolate at the given y coordinates.
+    """
+    ys_valid = ys[np.isfinite(ys)]
+    if ys_valid.size == 0:
+        return 0, 0
+    r0 = max(int(np.floor(ys_valid.min())) - _KERNEL_PAD, 0)
+    r1 = min(int(np.ceil(ys_valid.max())) + _KERNEL_PAD + 1, height)
+    return r0, r1
+
+# Number of modifiers each worker of correctBatch keeps for reuse.
+_BATCH_MODIFIERS = 16
+
+# The state of a correctBatch worker process: its database and modifiers.
+_batchState: dict = {}
+
+def correctBatch(tasks, workers=None, max_in_flight=None, load=None, flags=lensfunpy.ModifyFlags.ALL,
+                 interpolation='linear', database_kwargs=None):
+    """
+    Correct many images in a pool of worker processes, yielding the results in task order.
+    
+    Each task is an ``(image, camera, lens, focal, aperture, distance)`` tuple, and each
+    image is corrected with :meth:`lensfunpy.Modifier.correct`. Every worker loads one
+    :class:`lensfunpy.Database` and keeps the modifiers of recently used correction
+    parameters (camera, lens, focal length, aperture, distance, image shape and dtype),
+    so that tasks sharing parameters are corrected without setting up a modifier again.
+    At most `max_in_flight` tasks are submitted ahead of the result the caller waits for,
+    which bounds the memory used by images and results in flight.
+    
+    Camera and lens are looked up in the workers' database by maker and model, ignoring
+    case and whitespace, and lenses also by crop factor. Fuzzy matches are not used.
+    An exception raised for a task, e.g. if the camera or lens is not found or the lens
+    is ambiguous, is raised when its result is reached.
+    
+    :param tasks: iterable of ``(image, camera, lens, focal, aperture, distance)`` tuples.
+                  `camera` and `lens` are :class:`lensfunpy.Camera` and :class:`lensfunpy.Lens`
+                  instances or ``(maker, model)`` tuples, for lenses optionally
+                  ``(maker, model, crop_factor)``. Images have a pixel format
+                  supported by :meth:`lensfunpy.Modifier.initialize`.
+    :param int workers: number of worker processes, by default the number of CPUs.
+                        With 0, the tasks are corrected in the calling process.
+    :param int max_in_flight: maximum number of submitted but not yet returned tasks,
+                              by default twice the number of workers
+    :param load: if given, a picklable function called in the worker with the image item
+                 of a task, e.g. a file name, returning the image array
+    :param int flags: the corrections to apply, see :class:`lensfunpy.ModifyFlags`
+    :param str interpolation: 'linear' or 'nearest'
+    :param dict database_kwargs: keyword arguments for :class:`lensfunpy.Database` in each worker,
+                                 e.g. ``{'lazy': True}``
+    :return: iterator over the corrected images, in the order of the tasks
+    """
+    database_kwargs = dict(database_kwargs or {})
+    if workers == 0:
+        state = {}
+        _initBatchWorker(database_kwargs, state)
+        for task in tasks:
+            yield _correctBatchTask(_batchTask(task), load, flags, interpolation, state)
+        return
+    
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max(1, max_in_flight or 2 * workers)
+    pending = deque()
+    with ProcessPoolExecutor(workers, initializer=_initBatchWorker, initargs=(database_kwargs,)) as pool:
+        try:
+            for task in tasks:
+                if len(pending) >= max_in_flight:
+                    yield pending.popleft().result()
+                pending.append(pool.submit(_correctBatchTask, _batchTask(task), load, flags, interpolation))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # the caller stopped early or a task failed
+            for future in pending:
+                future.cancel()
+
+def _batchTask(task):
+    # replace camera and lens by their names, which can be sent to other processes
+    image, camera, lens, focal, aperture, distance = task
+    if isinstance(image, np.ndarray):
+        _checkPixelFormat(image)
+    return (image, _cameraName(camera), _lensName(lens), float(focal), float(aperture), float(distance))
+
+def _checkPixelFormat(image):
+    if image.dtype.type not in lensfunpy.npPixelFormat:
+        raise ValueError(f'unsupported image dtype {image.dtype.name}')
+
+def _cameraName(camera):
+    if isinstance(camera, (tuple, list)):
+        maker, model = camera
+        return maker, model
+    return camera.maker, camera.model
+
+def _lensName(lens):
+    if isinstance(lens, (tuple, list)):
+        if len(lens) == 2:
+            maker, model = lens
+            return maker, model, None
+        maker, model, crop_factor = lens
+        return maker, model, float(crop_factor)
+    return lens.maker, lens.model, lens.crop_factor
+
+def _initBatchWorker(database_kwargs, state=_batchState):
+    state.clear()
+    state['db'] = lensfunpy.Database(**database_kwargs)
+    state['modifiers'] = OrderedDict()
+
+def _batchModifier(state, camera, lens, focal, aperture, distance, image, flags):
+    key = (camera, lens, focal, aperture, distance, image.shape, image.dtype.str, flags)
+    modifiers = state['modifiers']
+    if key in modifiers:
+        modifiers.move_to_end(key)
+        return modifiers[key]
+    
+    _checkPixelFormat(image)
+    db = state['db']
+    cam = _findExact(db.find_cameras(*camera), camera, 'camera')
+    lens_ = _findExact(db.find_lenses(cam, *lens[:2]), lens, 'lens')
+    mod = lensfunpy.Modifier(lens_, cam.crop_factor, image.shape[1], image.shape[0])
+    mod.initialize(focal, aperture, distance, pixel_format=image.dtype.type, flags=flags)
+    modifiers[key] = mod
+    if len(modifiers) > _BATCH_MODIFIERS:
+        modifiers.popitem(last=False)
+    return mod
+
+def _findExact(entries, name, kind):
+    # the search is fuzzy, only accept an entry with exactly the given maker, model and crop factor
+    maker, model = _normalizeName(name[0]), _normalizeName(name[1])
+    crop_factor = name[2] if len(name) > 2 else None
+    matches = [entry for entry in entries
+               if _normalizeName(entry.maker) == maker and _normalizeName(entry.model) == model
+               and (crop_factor is None or entry.crop_factor == crop_factor)]
+    if not matches:
+        raise ValueError(f'{kind} {name[0]} {name[1]} not found in the database')
+    if len(matches) > 1 and crop_factor is None and len(set(entry.crop_factor for entry in matches)) > 1:
+        raise ValueError(f'{kind} {name[0]} {name[1]} is ambiguous, give its crop factor')
+    return matches[0]
+
+def _normalizeName(name):
+    # lensfun compares names ignoring case and repeated whitespace
+    return ' '.join(name.split()).lower()
+
+def _correctBatchTask(task, load, flags, interpolation, state=_batchState):
+    image, camera, lens, focal, aperture, distance = task
+    if load is not None:
+        image = load(image)
+    image = np.ascontiguousarray(image)
+    mod = _batchModifier(state, camera, lens, focal, aperture, distance, image, flags)
+    return mod.correct(image, interpolation=interpolation)
@@ -6,6 +6,7 @@ import os
 import shutil
 import sys
 import zipfile
+import importlib.util
 from urllib.request import urlretrieve
 
 import numpy
@@ -218,6 +219,12 @@ def bundle_db_files():
         dest = os.path.join(db_files, os.path.basename(path))
         print('copying', path, '->', dest)
         shutil.copyfile(path, dest)
+    # index of the makers and mounts in each file, used for Database(lazy=True),
+    # loaded from source as the extension is not built yet
+    spec = importlib.util.spec_from_file_location('_dbindex', 'lensfunpy/_dbindex.py')
+    dbindex = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(dbindex)
+    print('writing', dbindex.write_index(db_files))
 
 package_data = {'lensfunpy': ['py.typed', '_lensfun.pyi']}
 
@@ -251,6 +258,7 @@ if 'sdist' not in cmdline:
     # In that case, loading of bundled files can still be disabled
     # with Database(load_bundled=False).
     package_data['lensfunpy'].append('db_files/*.xml')
+    package_data['lensfunpy'].append('db_files/index.json')
     bundle_db_files()
 
 # Support for optional Cython line tracing
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import lensfunpy as lensfun
+from lensfunpy import aio, maps, util
+from numpy.testing import assert_equal
+
+cam_maker = 'NIKON CORPORATION'
+cam_model = 'NIKON D3S'
+lens_maker = 'Nikon'
+lens_model = 'Nikon AI-S Nikkor 28mm f/2.8'
+
+def getModifier(width, height, model=lens_model, focal=28.0, aperture=1.4):
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, model)[0]
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(focal, aperture, 10)
+    return mod
+
+def testAsyncCorrection():
+    width, height = 320, 240
+    mod = getModifier(width, height)
+    rng = np.random.RandomState(42)
+    im = rng.randint(0, 256, (height, width, 3)).astype(np.uint8)
+
+    async def main():
+        with ThreadPoolExecutor(2) as executor:
+            corrected = await aio.correct(mod, im, band_rows=50, executor=executor)
+            # lensfun accumulates along the rows of each call, so compare with the same bands
+            expected = np.concatenate([mod.correct(im, yu=y0, height=min(50, height - y0))
+                                       for y0 in range(0, height, 50)])
+            assert_equal(corrected, expected)
+
+            coords = await aio.apply_subpixel_geometry_distortion(mod, band_rows=50, executor=executor)
+            assert_equal(coords, np.concatenate([mod.apply_subpixel_geometry_distortion(0, y0, width, min(50, height - y0))
+                                                 for y0 in range(0, height, 50)]))
+            geometry = await aio.apply_geometry_distortion(mod, 10, 20, 100, 40, band_rows=50)
+            assert_equal(geometry, mod.apply_geometry_distortion(10, 20, 100, 40))
+
+            assert_equal(await aio.remap(im, coords, band_rows=50), util.remap(im, coords))
+            grid = maps.GridMap.from_modifier(mod, 'geometry')
+            assert_equal(await aio.remap(im, grid, band_rows=50), util.remap(im, grid))
+            fixed = maps.FixedPointMap.from_modifier(mod, 'geometry')
+            assert_equal(await aio.remap(im, fixed, band_rows=50), util.remap(im, fixed))
+
+            vign = getModifier(width, height, 'Nikkor AF 20mm f/2.8D', 20.0, 4.0)
+            vignetted = im.copy()
+            assert await aio.apply_color_modification(vign, vignetted, band_rows=50, executor=executor)
+            expected = im.copy()
+            for y0 in range(0, height, 50):
+                vign.apply_color_modification(expected, region=(0, y0, width, min(50, height - y0)))
+            assert_equal(vignetted, expected)
+
+            db = lensfun.Database()
+            cams = await aio.find_cameras(db, cam_maker, cam_model, executor=executor)
+            lenses = await aio.find_lenses(db, cams[0], lens_maker, lens_model, executor=executor)
+            assert_equal(lenses, db.find_lenses(cams[0], lens_maker, lens_model))
+
+    asyncio.run(main())
+    assert_equal(aio.memory_budget.inuse, 0)
+
+def testAsyncCancellation():
+    width, height = 320, 240
+    mod = getModifier(width, height)
+    im = np.zeros((height, width, 3), np.uint8)
+    budget = aio.MemoryBudget()
+    bands = []
+    started = threading.Event()
+
+    def correct(*args):
+        bands.append(args[3])
+        started.set()
+        return mod.correct(*args)
+
+    class SlowModifier:
+        width, height = mod.width, mod.height
+    slow = SlowModifier()
+    slow.correct = correct
+
+    async def main():
+        task = asyncio.ensure_future(aio.correct(slow, im, band_rows=10, budget=budget))
+        while not started.is_set():
+            await asyncio.sleep(0.001)
+        assert budget.inuse > 0
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    # the running band was completed, no further band was started
+    assert len(bands) < height // 10
+    assert_equal(budget.inuse, 0)
+
+def testMemoryBudget():
+    budget = aio.MemoryBudget(maxbytes=100)
+    order = []
+
+    async def request(name, nbytes, release):
+        async with budget.reserve(nbytes):
+            order.append(name)
+            assert budget.inuse <= budget.maxbytes or budget.inuse == nbytes
+            await release.wait()
+
+    async def main():
+        releases = [asyncio.Event() for _ in range(4)]
+        tasks = [asyncio.ensure_future(request(i, nbytes, release))
+                 for i, (nbytes, release) in enumerate(zip([60, 30, 50, 200], releases))]
+        await asyncio.sleep(0.01)
+        # the third request waits, and the fourth waits behind it
+        assert_equal(order, [0, 1])
+        assert_equal(budget.waiting, 2)
+
+        # cancelled requests do not hold up the ones behind them
+        tasks[2].cancel()
+        releases[0].set()
+        releases[1].set()
+        await asyncio.sleep(0.01)
+        # a request larger than the budget runs alone
+        assert_equal(order, [0, 1, 3])
+        assert_equal(budget.inuse, 200)
+        releases[3].set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert_equal(budget.inuse, 0)
+
+    asyncio.run(main())
@@ -1,7 +1,14 @@
 import numpy as np
 import lensfunpy as lensfun
 import gc
-from numpy.testing import assert_equal
+import os
+import pickle
+import weakref
+import threading
+import multiprocessing
+import pytest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from numpy.testing import assert_equal, assert_allclose
 
 # the following strings were taken from the lensfun xml files
 cam_maker = 'NIKON CORPORATION'
@@ -76,6 +83,452 @@ def testDatabaseXMLLoading():
     assert_equal(lens.maker.lower(), lens_maker.lower())
     assert_equal(lens.model.lower(), lens_model.lower())
     
+def testDatabaseLazy():
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    
+    lazy = lensfun.Database(lazy=True)
+    lazy_cam = lazy.find_cameras(cam_maker, cam_model)[0]
+    assert lazy_cam == cam
+    for maker in [lens_maker, 'Sigma', None]:
+        assert_equal(lazy.find_lenses(lazy_cam, maker), db.find_lenses(cam, maker))
+    assert_equal(lazy.find_mount(cam.mount).compat, db.find_mount(cam.mount).compat)
+    assert_equal(len(lazy.lenses), len(db.lenses))
+    assert_equal(len(lazy.cameras), len(db.cameras))
+    
+    # entries from other sources still override bundled ones,
+    # and entries returned before loading more files stay valid
+    xml = """
+<lensdatabase>
+    <camera>
+        <maker>Nikon Corporation</maker>
+        <model>Nikon D3S</model>
+        <mount>Nikon F AF</mount>
+        <cropfactor>1.5</cropfactor>
+    </camera>
+</lensdatabase>
+    """
+    lazy = lensfun.Database(xml=xml, load_common=False, lazy=True)
+    lazy_cam = lazy.find_cameras(cam_maker, cam_model)[0]
+    assert_equal(lazy_cam.crop_factor, 1.5)
+    lens = lazy.find_lenses(lazy_cam, lens_maker, lens_model)[0]
+    lazy.find_cameras('Canon')
+    # the entries of further files are added in place
+    assert lazy.find_cameras(cam_maker, cam_model)[0] is lazy_cam
+    assert lazy.find_lenses(lazy_cam, lens_maker, lens_model)[0] is lens
+    assert_equal(len(lazy.lenses), len(db.lenses))
+    assert_equal(len(lazy.cameras), len(db.cameras))
+    assert_equal(lazy_cam.crop_factor, 1.5)
+    assert_equal(lens.model, lens_model)
+    
+    # lenses of another crop factor only override bundled ones of the same crop factor
+    xml = """
+<lensdatabase>
+    <lens>
+        <maker>Nikon</maker>
+        <model>Nikkor AI-S 85mm f/2.0</model>
+        <mount>Nikon F AI-S</mount>
+        <cropfactor>1.5</cropfactor>
+    </lens>
+</lensdatabase>
+    """
+    def crop_factors(db):
+        return sorted(lens.crop_factor for lens in db.lenses if lens.model == 'Nikkor AI-S 85mm f/2.0')
+    eager = lensfun.Database(xml=xml, load_common=False)
+    lazy = lensfun.Database(xml=xml, load_common=False, lazy=True)
+    eager_cam = eager.find_cameras(cam_maker, cam_model)[0]
+    lazy_cam = lazy.find_cameras(cam_maker, cam_model)[0]
+    expected = eager.find_lenses(eager_cam, 'Nikon', 'Nikkor AI-S 85mm f/2.0')
+    assert_equal([lens.crop_factor for lens in expected], [1.0])
+    assert_equal(lazy.find_lenses(lazy_cam, 'Nikon', 'Nikkor AI-S 85mm f/2.0'), expected)
+    assert_equal(crop_factors(lazy), [1.0, 1.5])
+    assert_equal(crop_factors(eager), [1.0, 1.5])
+    assert_equal(len(lazy.lenses), len(eager.lenses))
+
+def testDatabaseLookupCache():
+    db = lensfun.Database(lookup_cache_size=2)
+    uncached = lensfun.Database(lookup_cache_size=0)
+    
+    cams = db.find_cameras(cam_maker, cam_model)
+    assert_equal(db.find_cameras(' nikon  corporation', 'Nikon D3S'), cams)
+    assert_equal(uncached.find_cameras(cam_maker, cam_model), cams)
+    cam = cams[0]
+    
+    lenses = db.find_lenses(cam, lens_maker, lens_model)
+    # returned lists may be modified without affecting the cache
+    lenses.append(None)
+    assert_equal(db.find_lenses(cam, lens_maker.upper(), lens_model), lenses[:-1])
+    assert_equal(db.find_lenses(cam, lens_maker, lens_model, loose_search=True),
+                 uncached.find_lenses(cam, lens_maker, lens_model, loose_search=True))
+    
+    queries = [(cam, lens_maker, lens_model), (cam, 'Sigma', None), (cam, lens_maker, lens_model)]
+    results = db.find_lenses_batch(queries)
+    assert_equal(len(results), len(queries))
+    for (camera, maker, lens), result in zip(queries, results):
+        assert_equal(result, uncached.find_lenses(camera, maker, lens))
+    
+    db.clear_lookup_cache()
+    assert_equal(db.find_cameras(cam_maker, cam_model), cams)
+
+def testDatabaseThreads():
+    # queries for cameras of many makers and a lens fitting each
+    ref = lensfun.Database()
+    mounts = set(mount.name for mount in ref.mounts)
+    queries = []
+    for cam in ref.cameras:
+        if cam.mount in mounts and cam.maker not in [q[0].maker for q in queries]:
+            lenses = ref.find_lenses(cam)
+            if lenses:
+                queries.append((cam, lenses[0]))
+    queries = queries[:16]
+    
+    def keys(entries):
+        # in the order of the scores
+        return [(entry.maker, entry.model) for entry in entries]
+    
+    def expected(cam, lens):
+        return (keys(ref.find_cameras(cam.maker, cam.model)),
+                keys(ref.find_cameras(cam.maker, cam.model, loose_search=True)),
+                keys(ref.find_lenses(cam, lens.maker, lens.model)),
+                keys(ref.find_lenses(cam, lens.maker, lens.model, loose_search=True)),
+                ref.find_mount(cam.mount).name)
+    expected = [expected(cam, lens) for cam, lens in queries]
+    
+    for lazy, lookup_cache_size in [(True, 0), (False, 0), (True, 1024)]:
+        # a fresh database per round, so that lazy loading happens concurrently
+        db = lensfun.Database(lazy=lazy, lookup_cache_size=lookup_cache_size)
+        threads = 16
+        barrier = threading.Barrier(threads)
+        
+        def hammer(thread):
+            barrier.wait()
+            results = []
+            for i in range(40):
+                n = (thread + i) % len(queries)
+                cam, lens = queries[n]
+                cams = db.find_cameras(cam.maker, cam.model)
+                db_cam = next(c for c in cams if c == cam)
+                result = (keys(cams),
+                          keys(db.find_cameras(cam.maker, cam.model, loose_search=True)),
+                          keys(db.find_lenses(db_cam, lens.maker, lens.model)),
+                          keys(db.find_lenses(db_cam, lens.maker, lens.model, loose_search=True)),
+                          db.find_mount(cam.mount).name)
+                results.append((n, result, db_cam))
+            return results
+        
+        with ThreadPoolExecutor(threads) as pool:
+            results = [r for rs in pool.map(hammer, range(threads)) for r in rs]
+        cams = {}
+        for n, result, db_cam in results:
+            assert_equal(result, expected[n])
+            # each entry has a single instance across threads
+            assert cams.setdefault(n, db_cam) is db_cam
+        assert_equal(len(db.lenses), len(ref.lenses))
+
+def testHashableEntries():
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    mount = db.find_mount(cam.mount)
+    
+    # one instance per entry
+    assert db.find_cameras(cam_maker, cam_model, loose_search=True)[0] is cam
+    assert db.find_lenses(cam, lens_maker, lens_model, loose_search=True)[0] is lens
+    assert db.find_mount(cam.mount) is mount
+    assert cam in db.cameras
+    
+    # equal entries of different databases have equal hashes
+    db2 = lensfun.Database(lookup_cache_size=0)
+    cam2 = db2.find_cameras(cam_maker, cam_model)[0]
+    lens2 = db2.find_lenses(cam2, lens_maker, lens_model)[0]
+    mount2 = db2.find_mount(cam.mount)
+    assert cam2 is not cam
+    entries = {cam: 1, lens: 2, mount: 3}
+    assert_equal(entries[cam2], 1)
+    assert_equal(entries[lens2], 2)
+    assert_equal(entries[mount2], 3)
+    assert_equal(len(set(db.lenses) | set(db2.lenses)), len(set(db.lenses)))
+
+def testDatabaseToArrays():
+    db = lensfun.Database()
+    lenses = db.lenses
+    arrays = db.to_arrays()
+    assert_equal(len(arrays.lenses), len(lenses))
+    assert_equal(len(arrays.distortion), sum(len(lens.calib_distortion) for lens in lenses))
+    assert_equal(len(arrays.tca), sum(len(lens.calib_tca) for lens in lenses))
+    assert_equal(len(arrays.vignetting), sum(len(lens.calib_vignetting) for lens in lenses))
+    
+    i = lenses.index(db.find_lenses(db.find_cameras(cam_maker, cam_model)[0], lens_maker, lens_model)[0])
+    lens = lenses[i]
+    row = arrays.lenses[i]
+    assert_equal(row['maker'], lens.maker)
+    assert_equal(row['model'], lens.model)
+    assert_equal(row['type'], lens.type.value)
+    assert_allclose([row['min_focal'], row['max_focal'], row['crop_factor']],
+                    [lens.min_focal, lens.max_focal, lens.crop_factor])
+    assert np.isnan(row['min_aperture']) == (lens.min_aperture is None)
+    
+    for rows, calibs in [(arrays.distortion, lens.calib_distortion),
+                         (arrays.tca, lens.calib_tca),
+                         (arrays.vignetting, lens.calib_vignetting)]:
+        rows = rows[rows['lens'] == i]
+        assert_equal(len(rows), len(calibs))
+        for row, calib in zip(rows, calibs):
+            assert_equal(row['model'], calib.model.value)
+            assert_allclose(row['focal'], calib.focal)
+            assert_allclose(row['terms'], calib.terms)
+
+def testDatabaseSnapshot(tmp_path):
+    path = str(tmp_path / 'snapshot.xml')
+    xml_path = str(tmp_path / 'extra.xml')
+    camera_xml = """
+    <camera>
+        <maker>Snapshot</maker>
+        <model>Camera {}</model>
+        <mount>Nikon F AF</mount>
+        <cropfactor>1.0</cropfactor>
+    </camera>"""
+    with open(xml_path, 'w') as f:
+        f.write('<lensdatabase>' + camera_xml.format(1) + '</lensdatabase>')
+    
+    db = lensfun.Database.from_snapshot(path, paths=[xml_path])
+    assert os.path.exists(path)
+    umask = os.umask(0o022)
+    os.umask(umask)
+    assert_equal(os.stat(path).st_mode & 0o777, 0o666 & ~umask)
+    db2 = lensfun.Database.from_snapshot(path, paths=[xml_path])
+    assert_equal(len(db2.cameras), len(db.cameras))
+    assert_equal(len(db2.lenses), len(db.lenses))
+    assert_equal(len(db2.mounts), len(db.mounts))
+    assert_equal(len(db2.find_cameras('Snapshot')), 1)
+    
+    # a snapshot of only some cameras and lenses
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    db.save_snapshot(path, cameras=[cam], lenses=db.find_lenses(cam, lens_maker))
+    db3 = lensfun.Database.from_snapshot(path, paths=[xml_path])
+    assert_equal(len(db3.cameras), 1)
+    cam3 = db3.find_cameras(cam_maker, cam_model)[0]
+    lens3 = db3.find_lenses(cam3, lens_maker, lens_model)[0]
+    assert cam3 == cam
+    assert lens3 == lens
+    assert_equal(lens3.interpolate_distortion(28.0), lens.interpolate_distortion(28.0))
+    
+    # modifying a source file invalidates the snapshot
+    with open(xml_path, 'w') as f:
+        f.write('<lensdatabase>' + camera_xml.format(1) + camera_xml.format(2) + '</lensdatabase>')
+    db4 = lensfun.Database.from_snapshot(path, paths=[xml_path])
+    assert_equal(len(db4.find_cameras('Snapshot')), 2)
+    assert_equal(len(db4.lenses), len(db.lenses))
+
+def _unpickledInWorker(objs):
+    db, cam, lens, mount, mod = objs
+    return db.fingerprint, cam, lens, mount.name, mod.apply_geometry_distortion()
+
+def testPickle(tmp_path):
+    db = lensfun.Database(lazy=True)
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    mount = db.find_mount(cam.mount)
+    mod = lensfun.Modifier(lens, cam.crop_factor, 300, 200)
+    mod.initialize(28.0, 1.4, 10)
+    
+    # within a process, the same database and entries are found
+    for obj in [db, cam, lens, mount]:
+        assert pickle.loads(pickle.dumps(obj)) is obj
+    # entries are pickled as keys, not as XML
+    assert len(pickle.dumps(lens)) < 1000
+    mod2 = pickle.loads(pickle.dumps(mod))
+    assert mod2.lens is lens
+    assert_equal(mod2.apply_geometry_distortion(), mod.apply_geometry_distortion())
+    assert pickle.loads(pickle.dumps(lensfun.Modifier(lens, 1.5, 300, 200))).crop == 1.5
+    
+    # a fresh process loads the database again
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        fingerprint, cam2, lens2, mount_name, coords = pool.submit(_unpickledInWorker, (db, cam, lens, mount, mod)).result()
+    assert_equal(fingerprint, db.fingerprint)
+    assert cam2 is cam and lens2 is lens
+    assert_equal(mount_name, mount.name)
+    assert_equal(coords, mod.apply_geometry_distortion())
+    
+    # a pickled database whose sources changed is not loaded
+    xml_path = str(tmp_path / 'extra.xml')
+    with open(xml_path, 'w') as f:
+        f.write('<lensdatabase><mount><name>Pickle</name></mount></lensdatabase>')
+    data = pickle.dumps(lensfun.Database(paths=[xml_path], load_common=False, load_bundled=False))
+    gc.collect()
+    with open(xml_path, 'w') as f:
+        f.write('<lensdatabase><mount><name>Pickled</name></mount></lensdatabase>')
+    with pytest.raises(lensfun.LensfunError):
+        pickle.loads(data)
+
+    # XML data is not pickled, an equal database must exist when unpickling
+    xml = '<lensdatabase>' + ''.join('<mount><name>Pickled {}</name></mount>'.format(i)
+                                     for i in range(100)) + '</lensdatabase>'
+    db = lensfun.Database(xml=xml, load_common=False, load_bundled=False)
+    mount = db.mounts[0]
+    data = pickle.dumps(mount)
+    assert len(data) < 1000
+    del db, mount
+    gc.collect()
+    with pytest.raises(lensfun.LensfunError):
+        pickle.loads(data)
+    db = lensfun.Database(xml=xml, load_common=False, load_bundled=False)
+    assert pickle.loads(data) is db.mounts[0]
+
+def testDatabaseIncrementalLoading(tmp_path):
+    db = lensfun.Database(load_common=False)
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    fingerprint = db.fingerprint
+    
+    # new entries are added in place
+    custom_xml = """
+    <lensdatabase>
+        <lens>
+            <maker>Custom</maker>
+            <model>Custom 50mm f/1.8</model>
+            <mount>Nikon F AF</mount>
+            <cropfactor>1.0</cropfactor>
+            <calibration>
+                <distortion model="ptlens" focal="50" a="0.01" b="-0.02" c="0.01"/>
+            </calibration>
+        </lens>
+    </lensdatabase>
+    """
+    db.load_xml(custom_xml)
+    assert db.fingerprint != fingerprint
+    assert db.find_cameras(cam_maker, cam_model)[0] is cam
+    assert db.find_lenses(cam, lens_maker, lens_model)[0] is lens
+    custom = db.find_lenses(cam, 'Custom')
+    assert_equal([l.model for l in custom], ['Custom 50mm f/1.8'])
+    
+    # overriding entries loads the database again, existing instances stay valid
+    xml_path = str(tmp_path / 'override.xml')
+    with open(xml_path, 'w') as f:
+        f.write("""<lensdatabase>
+            <camera>
+                <maker>{}</maker>
+                <model>{}</model>
+                <mount>Nikon F AF</mount>
+                <cropfactor>1.5</cropfactor>
+            </camera>
+        </lensdatabase>""".format(cam_maker, cam_model))
+    db.load_file(xml_path)
+    cam2 = db.find_cameras(cam_maker, cam_model)[0]
+    assert cam2 is not cam
+    assert_equal(cam2.crop_factor, 1.5)
+    assert_equal(cam.crop_factor, 1.0)
+    assert_equal(db.find_lenses(cam2, 'Custom')[0].model, 'Custom 50mm f/1.8')
+    assert_equal(len(db.find_lenses(cam, lens_maker, lens_model)), 1)
+    
+    # invalid data is not loaded
+    fingerprint = db.fingerprint
+    with pytest.raises(lensfun.XMLFormatError):
+        db.load_xml('garbage')
+    assert_equal(db.fingerprint, fingerprint)
+    assert pickle.loads(pickle.dumps(db)) is db
+    
+    # the incremental sources are part of the pickled database, XML data by its hash only
+    data = pickle.dumps(db)
+    fingerprint = db.fingerprint
+    assert b'Custom 50mm' not in data
+    del db, cam, cam2, lens, custom
+    gc.collect()
+    with pytest.raises(lensfun.LensfunError):
+        pickle.loads(data)
+    # a database of the same sources is used
+    db = lensfun.Database(load_common=False)
+    db.load_xml(custom_xml)
+    db.load_file(xml_path)
+    assert_equal(db.fingerprint, fingerprint)
+    assert pickle.loads(data) is db
+
+def testDatabaseWatcher(tmp_path):
+    camera_xml = """
+        <camera>
+            <maker>Watched</maker>
+            <model>Camera {}</model>
+            <mount>Nikon F AF</mount>
+            <cropfactor>{}</cropfactor>
+        </camera>"""
+    def write(name, *numbers, crop_factor=1.0):
+        with open(str(tmp_path / name), 'w') as f:
+            f.write('<lensdatabase>' + ''.join(camera_xml.format(number, crop_factor) for number in numbers) +
+                    '</lensdatabase>')
+    def models():
+        return sorted(cam.model for cam in db.find_cameras('Watched'))
+    
+    write('a.xml', 1)
+    db = lensfun.Database(load_common=False, load_bundled=False)
+    # files present are loaded right away
+    watcher = db.watch([str(tmp_path)], interval=3600)
+    assert_equal(models(), ['Camera 1'])
+    assert not watcher.check()
+    
+    write('b.xml', 2)
+    assert watcher.check()
+    assert_equal(models(), ['Camera 1', 'Camera 2'])
+    
+    # entries added to a file are loaded in place
+    cam = db.find_cameras('Watched', 'Camera 1')[0]
+    fingerprint = db.fingerprint
+    write('a.xml', 1, 11)
+    assert watcher.check()
+    assert_equal(models(), ['Camera 1', 'Camera 11', 'Camera 2'])
+    assert db.find_cameras('Watched', 'Camera 1')[0] is cam
+    assert db.fingerprint != fingerprint
+    
+    # modified entries are loaded into a new database
+    write('a.xml', 1, 11, crop_factor=1.5)
+    assert watcher.check()
+    cam2 = db.find_cameras('Watched', 'Camera 1')[0]
+    assert cam2 is not cam
+    assert_equal(cam2.crop_factor, 1.5)
+    assert_equal(cam.crop_factor, 1.0)
+    
+    # so are deleted files
+    write('a.xml', 33)
+    os.remove(str(tmp_path / 'b.xml'))
+    assert watcher.check()
+    assert_equal(models(), ['Camera 33'])
+    
+    with open(str(tmp_path / 'c.xml'), 'w') as f:
+        f.write('garbage')
+    with pytest.warns(RuntimeWarning):
+        assert not watcher.check()
+    # not tried again until modified
+    assert not watcher.check()
+    watcher.stop()
+    os.remove(str(tmp_path / 'c.xml'))
+    
+    with db.watch([str(tmp_path)], interval=0.01):
+        write('d.xml', 4)
+        for _ in range(500):
+            if len(models()) == 2:
+                break
+            threading.Event().wait(0.01)
+        assert_equal(models(), ['Camera 33', 'Camera 4'])
+    
+    # the background thread survives failing checks
+    watcher = lensfun.DatabaseWatcher(db, [str(tmp_path)], interval=0.01)
+    checked = threading.Event()
+    def check():
+        if not checked.is_set():
+            checked.set()
+            raise OSError('unreadable')
+        return lensfun.DatabaseWatcher.check(watcher)
+    watcher.check = check
+    with pytest.warns(RuntimeWarning):
+        with watcher:
+            watcher.start()
+            write('e.xml', 5)
+            for _ in range(500):
+                if len(models()) == 3:
+                    break
+                threading.Event().wait(0.01)
+    assert_equal(models(), ['Camera 33', 'Camera 4', 'Camera 5'])
+
 def testModifier():
     db = lensfun.Database()
     cam = db.find_cameras(cam_maker, cam_model)[0]
@@ -106,6 +559,85 @@ def testModifier():
     assert undistCoords.shape[0] == height and undistCoords.shape[1] == width
     assert np.any(undistCoords[:,:,0] != coords)
 
+def testModifierThreads():
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    
+    width = 1001
+    height = 667
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(28.0, 1.4, 10)
+    
+    # splitting the rows into bands must not change the result, apart from
+    # lensfun accumulating coordinates in single precision along each band
+    for apply in [mod.apply_geometry_distortion,
+                  mod.apply_subpixel_distortion,
+                  mod.apply_subpixel_geometry_distortion]:
+        expected = apply()
+        assert_allclose(apply(threads=4), expected, atol=0.05)
+        assert_allclose(apply(threads=height + 1), expected, atol=0.05)
+    
+    img = np.full((height, width, 3), 127, np.uint8)
+    img_threaded = img.copy()
+    mod.apply_color_modification(img)
+    mod.apply_color_modification(img_threaded, threads=3)
+    assert_equal(img_threaded, img)
+
+def testModifierReinitialize():
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, 'Nikon', 'Nikon AF-S Zoom-Nikkor 24-70mm f/2.8G ED')[0]
+    width, height = 300, 200
+    
+    # initializing again replaces the earlier corrections
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(24, 2.8, 10)
+    mod.initialize(70, 4, 10)
+    fresh = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    fresh.initialize(70, 4, 10)
+    assert_equal(mod.apply_subpixel_geometry_distortion(), fresh.apply_subpixel_geometry_distortion())
+    img = np.full((height, width, 3), 127, np.uint8)
+    expected = img.copy()
+    mod.apply_color_modification(img)
+    fresh.apply_color_modification(expected)
+    assert_equal(img, expected)
+
+def testModifierOut():
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    
+    width = 600
+    height = 400
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(28.0, 1.4, 10)
+    
+    expected = mod.apply_geometry_distortion()
+    out = np.empty((height, width, 2), np.float32)
+    res = mod.apply_geometry_distortion(out=out)
+    assert res is out
+    assert_equal(out, expected)
+    
+    # write a tile directly into a full-frame map
+    full = np.zeros((height, width, 3, 2), np.float32)
+    tile = full[100:200, 50:250]
+    mod.apply_subpixel_geometry_distortion(50, 100, 200, 100, out=tile)
+    expected = mod.apply_subpixel_geometry_distortion(50, 100, 200, 100)
+    assert_allclose(full[100:200, 50:250], expected, atol=0.05)
+    assert np.all(full[:100] == 0)
+    
+    for bad in [np.empty((height, width, 2), np.float64),
+                np.empty((height, width + 1, 2), np.float32),
+                np.empty((height, width, 2, 2), np.float32)[:, :, 0],
+                np.empty((height, width, 2), np.float32)[::-1]]:
+        try:
+            mod.apply_geometry_distortion(out=bad)
+        except ValueError:
+            pass
+        else:
+            assert False
+
 def testVignettingCorrection():
     cam_maker = 'NIKON CORPORATION'
     cam_model = 'NIKON D3S'
@@ -129,6 +661,248 @@ def testVignettingCorrection():
     mod.apply_color_modification(img)
     assert img.mean() > 127
 
+def testColorModificationLayouts():
+    db = lensfun.Database()
+    cam = db.find_cameras('NIKON CORPORATION', 'NIKON D3S')[0]
+    lens = db.find_lenses(cam, 'Nikon', 'Nikkor AF 20mm f/2.8D')[0]
+    width, height = 600, 400
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(20, 4, 10)
+    
+    expected = np.full((height, width, 3), 127, np.uint8)
+    assert mod.apply_color_modification(expected)
+    
+    # vignetting is corrected equally in all color channels
+    bgr = np.full((height, width, 3), 127, np.uint8)
+    assert mod.apply_color_modification(bgr, comp_role='BGR')
+    assert_equal(bgr, expected)
+    gray = np.full((height, width), 127, np.uint8)
+    assert mod.apply_color_modification(gray)
+    assert_equal(gray, expected[:,:,0])
+    
+    # alpha is left unchanged, also when correcting the RGB view only
+    for comp_role, view in [('RGBX', lambda a: a), (None, lambda a: a[:,:,:3])]:
+        rgba = np.full((height, width, 4), 127, np.uint8)
+        rgba[:,:,3] = 200
+        assert mod.apply_color_modification(view(rgba), comp_role=comp_role)
+        assert_equal(rgba[:,:,:3], expected)
+        assert (rgba[:,:,3] == 200).all()
+    
+    # views into a larger array and other buffers are modified in place
+    canvas = np.full((height + 10, width + 20, 3), 127, np.uint8)
+    assert mod.apply_color_modification(canvas[5:-5, 10:-10])
+    assert_equal(canvas[5:-5, 10:-10], expected)
+    assert (canvas[:5] == 127).all() and (canvas[:, :10] == 127).all()
+    img = np.full((height, width, 3), 127, np.uint8)
+    assert mod.apply_color_modification(memoryview(img))
+    assert_equal(img, expected)
+    
+    # a region of the full image, or the region only, up to rounding as lensfun
+    # accumulates pixel positions in single precision starting at the region
+    x, y, w, h = 100, 50, 300, 200
+    img = np.full((height, width, 3), 127, np.uint8)
+    assert mod.apply_color_modification(img, region=(x, y, w, h))
+    assert_allclose(img[y:y+h, x:x+w], expected[y:y+h, x:x+w], atol=1)
+    img[y:y+h, x:x+w] = 127
+    assert (img == 127).all()
+    tile = np.full((h, w, 3), 127, np.uint8)
+    assert mod.apply_color_modification(tile, region=(x, y, w, h), threads=2)
+    assert_allclose(tile, expected[y:y+h, x:x+w], atol=1)
+    
+    readonly = np.full((height, width, 3), 127, np.uint8)
+    readonly.flags.writeable = False
+    for img, kwargs in [(readonly, {}),
+                        (np.zeros((height, width, 3), np.uint16), {}),
+                        (np.zeros((height, width, 3), np.uint8), {'comp_role': 'RGBA'}),
+                        (np.zeros((height, width, 2), np.uint8), {}),
+                        (np.zeros((height, width, 3), np.uint8), {'region': (500, 0, 200, 10)}),
+                        (np.zeros((10, 10, 3), np.uint8), {})]:
+        with pytest.raises(ValueError):
+            mod.apply_color_modification(img, **kwargs)
+
+def testVignettingGain():
+    db = lensfun.Database()
+    cam = db.find_cameras('NIKON CORPORATION', 'NIKON D3S')[0]
+    lens = db.find_lenses(cam, 'Nikon', 'Nikkor AF 20mm f/2.8D')[0]
+    width, height = 600, 400
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(20, 4, 10)
+    
+    gain = mod.vignetting_gain(threads=2)
+    assert gain is not None
+    assert gain.shape == (height, width) and gain.dtype == np.float32
+    assert not gain.flags.writeable
+    assert mod.vignetting_gain() is gain
+    
+    expected = np.full((height, width, 3), 127, np.uint8)
+    mod.apply_color_modification(expected)
+    img = np.full((height, width, 3), 127, np.uint8)
+    assert mod.apply_vignetting_gain(img, threads=3)
+    assert_allclose(img, expected, atol=1)
+    
+    # other dtypes and layouts, integers are rounded and clipped
+    planar = np.full((3, height, width), 0.5, np.float32)
+    assert mod.apply_vignetting_gain(planar.transpose(1, 2, 0))
+    assert_allclose(planar, np.broadcast_to(0.5 * gain, planar.shape), rtol=1e-6)
+    gray = np.full((height, width), 60000, np.uint16)
+    assert mod.apply_vignetting_gain(gray)
+    assert_equal(gray, np.minimum(np.floor(60000 * gain.astype(np.float64) + 0.5), 65535))
+    
+    with pytest.raises(ValueError):
+        mod.apply_vignetting_gain(np.zeros((10, 10), np.uint8))
+    
+    mod.initialize(20, 4, 10, flags=lensfun.ModifyFlags.DISTORTION)
+    assert mod.vignetting_gain() is None
+    assert not mod.apply_vignetting_gain(img)
+
+def testLensInterpolateArray():
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    
+    focals = np.array([[20, 28], [28.5, 50]], np.float32)
+    
+    # the same as interpolating each value separately
+    for interpolate, interpolate_array, dtype in [
+            (lens.interpolate_distortion, lens.interpolate_distortion_array, lensfun.calib_distortion_dtype),
+            (lens.interpolate_tca, lens.interpolate_tca_array, lensfun.calib_tca_dtype)]:
+        calibs = interpolate_array(focals)
+        assert_equal(calibs.dtype, dtype)
+        assert_equal(calibs.shape, focals.shape)
+        for calib, focal in zip(calibs.ravel(), focals.ravel()):
+            expected = interpolate(focal)
+            if expected is None:
+                assert_equal(calib['model'], 0)
+            else:
+                assert_equal(calib['model'], expected.model.value)
+                assert_allclose(calib['focal'], expected.focal)
+                assert_allclose(calib['terms'], expected.terms)
+    
+    lens = db.find_lenses(cam, 'Nikon', 'Nikkor AF 20mm f/2.8D')[0]
+    apertures = np.array([[2.8, 4], [5.6, 8]], np.float32)
+    distances = np.array([1, 10], np.float32)
+    calibs = lens.interpolate_vignetting_array(20, apertures, distances)
+    assert_equal(calibs.dtype, lensfun.calib_vignetting_dtype)
+    assert_equal(calibs.shape, apertures.shape)
+    for calib, aperture, distance in zip(calibs.ravel(), apertures.ravel(), np.tile(distances, 2)):
+        expected = lens.interpolate_vignetting(20, aperture, distance)
+        assert_equal(calib['model'], expected.model.value)
+        assert_allclose([calib['focal'], calib['aperture'], calib['distance']],
+                        [expected.focal, expected.aperture, expected.distance])
+        assert_allclose(calib['terms'], expected.terms)
+    
+    assert_equal(lens.interpolate_distortion_array([]).shape, (0,))
+
+def testTransformPoints():
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    width, height = 320, 240
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(28.0, 1.4, 10)
+    
+    pts = np.array([[0, 0], [10, 20], [160.5, 120.25], [319, 239]], np.float32)
+    # same as computing a 1x1 coordinate map for each point
+    expected = np.concatenate([mod.apply_geometry_distortion(x, y, 1, 1)[0] for x, y in pts])
+    assert_allclose(mod.transform_points(pts), expected, rtol=1e-6)
+    expected = np.concatenate([mod.apply_subpixel_geometry_distortion(x, y, 1, 1)[0] for x, y in pts])
+    assert_allclose(mod.transform_points_subpixel_geometry(pts), expected, rtol=1e-6)
+    coords = mod.apply_geometry_distortion()
+    assert_allclose(mod.transform_points(pts[[0,1,3]]), coords[[0,20,239],[0,10,319]], atol=0.05)
+    assert_equal(mod.transform_points_subpixel(pts).shape, (4, 3, 2))
+    
+    # reverse maps the distorted points back
+    distorted = mod.transform_points(pts)
+    assert_allclose(mod.transform_points(distorted, reverse=True), pts, atol=0.01)
+    
+    out = np.empty((4, 2), np.float32)
+    assert mod.transform_points(pts.tolist(), out=out) is out
+    assert_equal(mod.transform_points(np.empty((0, 2))).shape, (0, 2))
+    with pytest.raises(ValueError):
+        mod.transform_points(pts[:,0])
+
+def testRadialLut():
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    width, height = 320, 240
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(28.0, 1.4, 10)
+    
+    pts = np.array([[0, 0], [10, 20], [160, 120], [300, 7], [319, 239]])
+    coords = mod.apply_geometry_distortion(radial_lut=True)
+    assert_allclose(coords[pts[:,1],pts[:,0]], mod.transform_points(pts), atol=0.01)
+    assert_allclose(coords, mod.apply_geometry_distortion(), atol=0.05)
+    coords = mod.apply_subpixel_geometry_distortion(radial_lut=True)
+    assert_allclose(coords[pts[:,1],pts[:,0]], mod.transform_points_subpixel_geometry(pts), atol=0.01)
+    assert_allclose(coords, mod.apply_subpixel_geometry_distortion(), atol=0.05)
+    
+    # regions, threads and out behave as without the lookup table
+    region = mod.apply_subpixel_distortion(-20, 30, 100, 250, radial_lut=True)
+    assert_allclose(region, mod.apply_subpixel_distortion(-20, 30, 100, 250), atol=0.05)
+    out = np.empty((height, width, 3, 2), np.float32)
+    assert mod.apply_subpixel_geometry_distortion(threads=3, out=out, radial_lut=True) is out
+    assert_equal(out, coords)
+    
+    # nothing to correct
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(28.0, 1.4, 10, flags=lensfun.ModifyFlags.VIGNETTING)
+    assert mod.apply_geometry_distortion(radial_lut=True) is None
+
+def testCorrect():
+    from scipy.ndimage import map_coordinates
+    
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, 'Nikon', 'Nikkor AF 20mm f/2.8D')[0]
+    width = 320
+    height = 240
+    tile_rows = 16
+    
+    img = np.random.RandomState(42).rand(height, width, 3).astype(np.float32)
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(20, 4, 10, pixel_format=np.float32)
+    
+    # same as the separate vignetting, coordinates and remapping passes
+    expected = img.copy()
+    assert mod.apply_color_modification(expected)
+    coords = np.concatenate([mod.apply_subpixel_geometry_distortion(0, y0, width, min(tile_rows, height - y0))
+                             for y0 in range(0, height, tile_rows)])
+    expected = np.dstack([map_coordinates(expected[:,:,c], [coords[:,:,c,1], coords[:,:,c,0]], order=1)
+                          for c in range(3)])
+    
+    original = img.copy()
+    corrected = mod.correct(img, tile_rows=tile_rows)
+    assert_equal(img, original)
+    assert_allclose(corrected, expected, atol=1e-4)
+    
+    out = np.empty_like(img)
+    assert mod.correct(img, out, tile_rows=tile_rows, threads=3) is out
+    assert_equal(out, corrected)
+    
+    # a band of rows only
+    band = mod.correct(img, yu=32, height=tile_rows, tile_rows=tile_rows)
+    assert_equal(band, corrected[32:32 + tile_rows])
+    
+    nearest = mod.correct(img, interpolation='nearest')
+    assert_equal(nearest.shape, img.shape)
+    
+    # the remaining rows by default, rows outside the image are rejected
+    assert_equal(mod.correct(img, yu=height - 3 * tile_rows, tile_rows=tile_rows), corrected[-3 * tile_rows:])
+    for yu, rows in [(-1, 10), (height - 10, 11), (height + 1, -1)]:
+        with pytest.raises(ValueError):
+            mod.correct(img, yu=yu, height=rows)
+    # lensfun writes pixels of the format given to initialize
+    with pytest.raises(ValueError):
+        mod.correct((img * 255).astype(np.uint8))
+    
+    # nearest neighbour values are copied exactly
+    big = np.full((height, width, 3), 2**32 - 3, np.uint32)
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(20, 4, 10, pixel_format=np.uint32, flags=lensfun.ModifyFlags.DISTORTION)
+    nearest = mod.correct(big, interpolation='nearest')
+    assert_equal(np.unique(nearest), [0, 2**32 - 3])
+
 def testDeallocationBug():
     db = lensfun.Database()
     cam = db.find_cameras(cam_maker, cam_model)[0]
@@ -145,6 +919,23 @@ def testDeallocationBug():
     assert_equal(cam.maker.lower(), cam_maker.lower())
     assert_equal(lens.maker.lower(), lens_maker.lower())
 
+def testDeallocationWithoutCycles():
+    db = lensfun.Database(load_common=False)
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    ref = weakref.ref(db)
+    
+    # the database and its entries are freed by reference counting alone
+    gc.disable()
+    try:
+        del db
+        assert ref() is not None
+        assert ref().find_cameras(cam_maker, cam_model)[0] is cam
+        del cam, lens
+        assert ref() is None
+    finally:
+        gc.enable()
+
 def testXmlFormatException():
     try:
         lensfun.Database(xml='garbage')
@@ -0,0 +1,228 @@
+import os
+import pickle
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+import lensfunpy as lensfun
+from lensfunpy import maps
+from numpy.testing import assert_equal, assert_allclose
+
+cam_maker = 'NIKON CORPORATION'
+cam_model = 'NIKON D3S'
+lens_maker = 'Nikon'
+lens_model = 'Nikon AI-S Nikkor 28mm f/2.8'
+
+def getLens():
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    return cam, lens
+
+def testMapCache():
+    cam, lens = getLens()
+    width, height = 300, 200
+    nbytes = width * height * 3 * 2 * 4
+    cache = maps.MapCache(maxbytes=2 * nbytes)
+
+    coords = cache.get(lens, cam.crop_factor, width, height, 28.0, 1.4, 10)
+    assert coords is not None
+    assert not coords.flags.writeable
+    assert cache.get(lens, cam.crop_factor, width, height, 28.0, 1.4, 10) is coords
+
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(28.0, 1.4, 10)
+    assert_equal(coords, mod.apply_subpixel_geometry_distortion())
+
+    geometry = cache.get(lens, cam.crop_factor, width, height, 28.0, 1.4, 10, kind='geometry')
+    assert geometry is not None and geometry.shape == (height, width, 2)
+    cache.get(lens, cam.crop_factor, width, height, 28.0, 2.8, 10)
+    cache.get(lens, cam.crop_factor, width, height, 28.0, 4.0, 10)
+
+    info = cache.cache_info()
+    assert_equal(info.hits, 1)
+    assert_equal(info.misses, 4)
+    assert info.evictions >= 1
+    assert info.currbytes <= info.maxbytes
+
+    # the least recently used map was evicted
+    assert cache.get(lens, cam.crop_factor, width, height, 28.0, 1.4, 10) is not coords
+
+    cache.clear()
+    assert_equal(len(cache), 0)
+    assert_equal(cache.cache_info().misses, 0)
+
+def testMapKeyCalibration():
+    db = lensfun.Database(load_common=False)
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    key = maps.map_key(lens, cam.crop_factor, 300, 200, 28.0, 1.4, 10)
+    
+    # the same lens with other calibration data
+    db.load_xml("""
+    <lensdatabase>
+        <lens>
+            <maker>{}</maker>
+            <model>{}</model>
+            <mount>Nikon F AI-S</mount>
+            <cropfactor>1.0</cropfactor>
+            <calibration>
+                <distortion model="ptlens" focal="28" a="0.01" b="-0.02" c="0.002"/>
+            </calibration>
+        </lens>
+    </lensdatabase>
+    """.format(lens_maker, lens_model))
+    lens2 = db.find_lenses(cam, lens_maker, lens_model)[0]
+    assert maps.map_key(lens2, cam.crop_factor, 300, 200, 28.0, 1.4, 10) != key
+    assert_equal(maps.lens_key(lens2)[:-1], maps.lens_key(lens)[:-1])
+
+def testMapStore(tmp_path):
+    cam, lens = getLens()
+    width, height = 300, 200
+    store = maps.MapStore(str(tmp_path))
+
+    coords = store.get(lens, cam.crop_factor, width, height, 28.0, 1.4, 10, kind='geometry')
+    assert isinstance(coords, np.memmap)
+    assert not coords.flags.writeable
+
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(28.0, 1.4, 10)
+    assert_equal(coords, mod.apply_geometry_distortion())
+
+    key = maps.map_key(lens, cam.crop_factor, width, height, 28.0, 1.4, 10, kind='geometry')
+    assert key in store
+    # created with the umask like any other file, not only readable by the owner
+    umask = os.umask(0o022)
+    os.umask(umask)
+    for name in os.listdir(str(tmp_path)):
+        assert_equal(os.stat(str(tmp_path / name)).st_mode & 0o777, 0o666 & ~umask)
+    assert_equal(len(store.index()), 1)
+
+    # another store on the same directory, e.g. in another process, loads the stored map
+    cache = maps.MapCache(store=maps.MapStore(str(tmp_path)))
+    loaded = cache.get(lens, cam.crop_factor, width, height, 28.0, 1.4, 10, kind='geometry')
+    assert isinstance(loaded, np.memmap)
+    assert_equal(loaded, coords)
+
+    store.clear()
+    assert key not in store
+    assert_equal(store.index(), {})
+
+def testCompactMaps():
+    cam, lens = getLens()
+    width, height = 300, 200
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(28.0, 1.4, 10)
+    coords = mod.apply_subpixel_geometry_distortion()
+    
+    pts = np.array([[0, 0], [299, 199], [17, 5], [150, 100], [203, 61]])
+    for order in [1, 3]:
+        grid = maps.GridMap.from_modifier(mod, step=8, order=order)
+        assert grid.shape == coords.shape
+        assert grid.grid.dtype == np.float32
+        assert grid.nbytes * 40 < coords.nbytes
+        assert grid.max_error < 0.01
+        expanded = np.asarray(grid)
+        assert_allclose(expanded[pts[:,1],pts[:,0]], mod.transform_points_subpixel_geometry(pts), atol=0.01)
+        assert_equal(grid.coords(50, 70), expanded[50:70])
+    grid = maps.GridMap.from_modifier(mod, 'geometry', step=32)
+    assert grid.coords().shape == (height, width, 2)
+    
+    half = maps.HalfMap.from_coords(coords)
+    assert half.nbytes * 2 == coords.nbytes
+    assert_equal(half.max_error, np.abs(half.coords() - coords).max())
+    assert half.max_error < 0.01
+    
+    fixed = maps.FixedPointMap.from_modifier(mod)
+    assert fixed.nbytes * 4 == coords.nbytes * 3
+    assert_equal(fixed.max_error, np.abs(fixed.coords() - coords).max())
+    assert fixed.max_error <= 1 / 64
+    assert_equal(fixed.coords(10, 20), np.asarray(fixed)[10:20])
+    
+    # the format of cv2.convertMaps
+    geometry = mod.apply_geometry_distortion()
+    fixed = maps.FixedPointMap.from_coords(geometry)
+    x, y = geometry[..., 0] * 32, geometry[..., 1] * 32
+    assert_equal(fixed.map1, np.stack([np.rint(x) // 32, np.rint(y) // 32], axis=-1))
+    assert_equal(fixed.map2, (np.rint(y) % 32) * 32 + np.rint(x) % 32)
+    
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(28.0, 1.4, 10, flags=lensfun.ModifyFlags.VIGNETTING)
+    assert maps.GridMap.from_modifier(mod) is None
+    assert maps.HalfMap.from_modifier(mod) is None
+
+def testFocalSequence():
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, 'Nikon', 'Nikon AF-S Zoom-Nikkor 24-70mm f/2.8G ED')[0]
+    width, height = 300, 200
+    seq = maps.FocalSequence(lens, cam.crop_factor, width, height, kind='geometry', focal_tolerance=0.02)
+    
+    def exact(focal, aperture=2.8, distance=10):
+        mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+        mod.initialize(focal, aperture, distance)
+        return mod
+    
+    # maps are interpolated between grid focal lengths, at most 2% apart
+    errors = []
+    for focal in np.linspace(24, 40, 9):
+        coords = seq.coords(focal)
+        assert not coords.flags.writeable
+        errors.append(np.abs(coords - exact(focal).apply_geometry_distortion()).max())
+    assert max(errors) < 0.05
+    info = seq.cache.cache_info()
+    assert info.misses <= 27
+    
+    # unchanged frames are served without computation
+    assert seq.coords(40) is seq.coords(40.0)
+    assert_equal(seq.cache.cache_info().misses, info.misses)
+    
+    nearest = maps.FocalSequence(lens, cam.crop_factor, width, height, kind='geometry', interpolate=False)
+    coords = nearest.coords(30.1)
+    assert nearest.coords(30.15) is coords
+    assert_equal(nearest.cache.cache_info().misses, 1)
+    
+    gain = seq.vignetting_gain(35, 2.8, 10)
+    assert seq.vignetting_gain(35.1, 2.85, 10.1) is gain
+    assert_allclose(gain, exact(35).vignetting_gain(), rtol=0.05)
+    
+    # invalid arguments are rejected up front
+    with pytest.raises(ValueError):
+        seq.coords(0)
+    with pytest.raises(ValueError):
+        seq.vignetting_gain(35, -2.8, 10)
+    with pytest.raises(ValueError):
+        maps.FocalSequence(lens, cam.crop_factor, width, height, focal_tolerance=0)
+
+def _sharedMapSum(shared):
+    coords = shared.coords()
+    assert not coords.flags.owndata
+    total = float(coords.sum(dtype=np.float64))
+    del coords
+    shared.close()
+    return total
+
+def testSharedMap():
+    cam, lens = getLens()
+    width, height = 300, 200
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(28.0, 1.4, 10)
+    coords = mod.apply_subpixel_geometry_distortion()
+    
+    with maps.SharedMap.publish(coords) as shared:
+        assert_equal(shared.shape, coords.shape)
+        assert_equal(shared.nbytes, coords.nbytes)
+        assert_equal(np.asarray(shared), coords)
+        assert not shared.coords().flags.writeable
+        assert_equal(shared.coords(10, 20), coords[10:20])
+        # only the name of the block is pickled
+        assert len(pickle.dumps(shared)) < 1000
+        
+        attached = pickle.loads(pickle.dumps(shared))
+        assert_equal(attached.coords(), coords)
+        attached.close()
+        
+        with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context('spawn')) as pool:
+            totals = list(pool.map(_sharedMapSum, [shared] * 3))
+        assert_equal(totals, [coords.sum(dtype=np.float64)] * 3)
@@ -0,0 +1,167 @@
+import numpy as np
+import pytest
+import lensfunpy as lensfun
+from lensfunpy import util, maps
+from numpy.testing import assert_equal
+from scipy.ndimage import map_coordinates
+
+cam_maker = 'NIKON CORPORATION'
+cam_model = 'NIKON D3S'
+lens_maker = 'Nikon'
+lens_model = 'Nikon AI-S Nikkor 28mm f/2.8'
+
+def getModifier(width, height):
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+    mod.initialize(28.0, 1.4, 10)
+    return mod
+
+def remapScipyReference(im, coords):
+    # the original implementation interpolating all channels at once
+    height, width = im.shape[0], im.shape[1]
+    coords = coords[:,:,::-1]
+    coords_channels = np.empty((height, width, 3, 3))
+    coords_channel = np.zeros((height, width, 3))
+    coords_channel[:,:,:2] = coords
+    coords_channels[:,:,0] = coords_channel
+    coords_channels[:,:,1] = coords_channel
+    coords_channels[:,:,1,2] = 1
+    coords_channels[:,:,2] = coords_channel
+    coords_channels[:,:,2,2] = 2
+    coords = np.rollaxis(coords_channels, 3)
+    return map_coordinates(im, coords, order=1)
+
+def testRemapScipy():
+    width, height = 320, 240
+    mod = getModifier(width, height)
+    coords = mod.apply_geometry_distortion()
+    rng = np.random.RandomState(42)
+    for dtype in [np.uint8, np.float32]:
+        im = (rng.rand(height, width, 3) * 255).astype(dtype)
+        expected = remapScipyReference(im, coords)
+        assert_equal(util.remapScipy(im, coords), expected)
+        assert_equal(util.remapScipy(im, coords, strip_rows=7), expected)
+
+    gray = util.remapScipy(im[:,:,1], coords)
+    assert_equal(gray, expected[:,:,1])
+
+def testRemapBands(tmp_path):
+    width, height = 320, 240
+    band_rows = 50
+    mod = getModifier(width, height)
+    
+    rng = np.random.RandomState(42)
+    im = np.memmap(str(tmp_path / 'in.raw'), np.uint8, 'w+', shape=(height, width, 3))
+    im[:] = rng.randint(0, 256, im.shape)
+    out = np.memmap(str(tmp_path / 'out.raw'), np.uint8, 'w+', shape=(height, width, 3))
+    
+    res = util.remapBands(im, mod, out, band_rows=band_rows)
+    assert res is out
+    
+    # same as remapping the full image with coordinates computed band-wise
+    coords = np.concatenate([mod.apply_geometry_distortion(0, y0, width, min(band_rows, height - y0))
+                             for y0 in range(0, height, band_rows)])
+    assert_equal(np.asarray(out), util.remap(np.asarray(im), coords))
+    
+    gray = util.remapBands(np.asarray(im[:,:,0]), mod, band_rows=band_rows)
+    assert_equal(gray.shape, (height, width))
+
+def testRemapSubpixel(monkeypatch):
+    width, height = 320, 240
+    mod = getModifier(width, height)
+    coords = mod.apply_subpixel_geometry_distortion()
+    rng = np.random.RandomState(42)
+    im = rng.randint(0, 256, (height, width, 3)).astype(np.uint8)
+    
+    for cv2 in [util.cv2, None]:
+        monkeypatch.setattr(util, 'cv2', cv2)
+        # each channel is remapped as if remapping the whole image with its coordinates
+        expected = np.dstack([util.remap(im, np.ascontiguousarray(coords[:,:,c]))[:,:,c]
+                              for c in range(3)])
+        assert_equal(util.remapSubpixel(im, coords, strip_rows=33), expected)
+        out = np.zeros_like(im)
+        assert util.remapSubpixel(im, coords, out) is out
+        assert_equal(out, expected)
+        assert_equal(util.remap(im, coords), expected)
+        
+        expected = util.remap(im, np.concatenate([mod.apply_subpixel_geometry_distortion(0, y0, width, min(50, height - y0))
+                                                  for y0 in range(0, height, 50)]))
+        assert_equal(util.remapBands(im, mod, band_rows=50, subpixel=True), expected)
+
+def testRemapCompact(monkeypatch):
+    width, height = 320, 240
+    mod = getModifier(width, height)
+    rng = np.random.RandomState(42)
+    im = rng.randint(0, 256, (height, width, 3)).astype(np.uint8)
+    
+    grid = maps.GridMap.from_modifier(mod, 'geometry')
+    assert_equal(util.remap(im, grid), util.remap(im, grid.coords()))
+    
+    fixed = maps.FixedPointMap.from_modifier(mod, 'geometry')
+    if util.cv2:
+        map1, map2 = util.cv2.convertMaps(mod.apply_geometry_distortion(), None, util.cv2.CV_16SC2)
+        assert_equal(fixed.map1, map1)
+        assert_equal(fixed.map2, map2)
+        expected = util.cv2.remap(im, map1, map2, util.cv2.INTER_LANCZOS4)
+        assert_equal(util.remap(im, fixed), expected)
+    assert_equal(util.remap(im, fixed.maps), util.remap(im, fixed))
+    
+    # per-channel maps are used for one channel each
+    fixed = maps.FixedPointMap.from_modifier(mod, 'subpixel_geometry')
+    expected = np.dstack([util.remap(im, (np.ascontiguousarray(fixed.map1[:,:,c]),
+                                          np.ascontiguousarray(fixed.map2[:,:,c])))[:,:,c]
+                          for c in range(3)])
+    assert_equal(util.remap(im, fixed), expected)
+    
+    monkeypatch.setattr(util, 'cv2', None)
+    assert_equal(util.remap(im, fixed), util.remap(im, fixed.coords()))
+
+def testCorrectBatch(tmp_path):
+    width, height = 320, 240
+    db = lensfun.Database()
+    cam = db.find_cameras(cam_maker, cam_model)[0]
+    lens = db.find_lenses(cam, lens_maker, lens_model)[0]
+    rng = np.random.RandomState(42)
+    images = [rng.randint(0, 256, (height, width, 3)).astype(np.uint8) for _ in range(5)]
+    apertures = [1.4, 2.8, 1.4, 1.4, 2.8]
+    
+    expected = []
+    for im, aperture in zip(images, apertures):
+        mod = lensfun.Modifier(lens, cam.crop_factor, width, height)
+        mod.initialize(28.0, aperture, 10)
+        expected.append(mod.correct(im))
+    
+    tasks = [(im, cam, lens, 28.0, aperture, 10) for im, aperture in zip(images, apertures)]
+    # cameras and lenses may also be given by name
+    tasks[1] = (images[1], (cam_maker, cam_model), (lens.maker, lens.model), 28.0, 2.8, 10)
+    for workers in [0, 2]:
+        results = list(util.correctBatch(tasks, workers=workers, max_in_flight=2))
+        assert_equal(len(results), len(expected))
+        for result, exp in zip(results, expected):
+            assert_equal(result, exp)
+    
+    # images loaded in the workers
+    paths = []
+    for i, im in enumerate(images):
+        paths.append(str(tmp_path / f'{i}.npy'))
+        np.save(paths[-1], im)
+    tasks = [(path, cam, lens, 28.0, aperture, 10) for path, aperture in zip(paths, apertures)]
+    for result, exp in zip(util.correctBatch(tasks, workers=2, load=np.load), expected):
+        assert_equal(result, exp)
+    
+    tasks = [(images[0], cam, ('Nikon', 'No such lens'), 28.0, 1.4, 10)]
+    with pytest.raises(ValueError):
+        list(util.correctBatch(tasks, workers=1))
+    # only exact matches are used, not the best fuzzy match
+    tasks = [(images[0], cam, ('Nikon', 'Nikkor 28mm'), 28.0, 1.4, 10)]
+    with pytest.raises(ValueError):
+        list(util.correctBatch(tasks, workers=0))
+    tasks = [(images[0], cam, (lens.maker, lens.model, 1.5), 28.0, 1.4, 10)]
+    with pytest.raises(ValueError):
+        list(util.correctBatch(tasks, workers=0))
+    # unsupported images are rejected when submitted
+    tasks = [(images[0].astype(np.int16), cam, lens, 28.0, 1.4, 10)]
+    with pytest.raises(ValueError):
+        next(util.correctBatch(tasks, workers=1))